@@ -0,0 +1,253 @@
+"""
+Micro-benchmarks for the pipeline. Each one prints its numbers and exits
+non-zero when it misses its budget, so they can run as regression checks:
+
+    python benchmark.py startup docs_builder transcript_io preprocess pipeline dedup
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# SDKs that must stay out of the CLI's import path (loaded lazily by the commands that need them)
+HEAVY_MODULES = (
+    "google.generativeai",
+    "googleapiclient",
+    "google.oauth2",
+    "httplib2",
+    "youtube_transcript_api",
+    "edge_tts",
+    "aiohttp",
+    "markdown",
+    "bs4",
+)
+
+STARTUP_SCRIPT = """
+import json, sys, contextlib, io
+import main
+with contextlib.redirect_stdout(io.StringIO()):
+    main.main(["status"])
+print(json.dumps(sorted(m for m in {heavy!r} if m in sys.modules)))
+"""
+
+
+def bench_startup(runs: int = 5, budget_ms: float = 200) -> bool:
+    """Time `main.py status` in fresh interpreters and check no heavy SDK gets imported."""
+    script = STARTUP_SCRIPT.format(heavy=HEAVY_MODULES)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings, loaded = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", script], cwd=cwd, capture_output=True, text=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        if result.returncode != 0:
+            print(result.stderr)
+            return False
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+
+    median = statistics.median(timings)
+    print(f"⏱️ main.py status: median {median:.0f} ms, best {min(timings):.0f} ms over {runs} runs (budget {budget_ms:.0f} ms)")
+    if loaded:
+        print(f"❌ Heavy modules imported at startup: {', '.join(loaded)}")
+    return median <= budget_ms and not loaded
+
+
+def synthetic_report(blocks: int) -> list:
+    """Block structure shaped like a Gemini report: headings, styled paragraphs, lists and code."""
+    pattern = [
+        {"type": "heading", "level": 2, "text": "Section 🚀 overview"},
+        {"type": "paragraph", "text": "Uses **vLLM** with *paged attention* and `max_tokens=512`, see [docs](https://example.com)."},
+        {"type": "list", "items": ["first **point**", {"text": "nested *detail*", "level": 1}, "third"]},
+        {"type": "code", "language": "python", "code": "def f(x):\n    return x * 2"},
+    ]
+    return [pattern[i % len(pattern)] for i in range(blocks)]
+
+
+def check_linear(label, unit, fn, make_input, sizes, max_ratio: float = 1.5) -> bool:
+    """Time fn(make_input(size)) over growing sizes and fail if the per-item cost grows more than max_ratio."""
+    per_item = []
+    for size in sizes:
+        data = make_input(size)
+        best = min(_timed(fn, data) for _ in range(5))
+        per_item.append(best / size * 1e6)
+        print(f"{label}: {size:>6} {unit} in {best * 1000:7.1f} ms ({per_item[-1]:.2f} µs/{unit[:-1]})")
+    ratio = per_item[-1] / per_item[0]
+    print(f"   per-{unit[:-1]} cost at {sizes[-1]} vs {sizes[0]} {unit}: {ratio:.2f}x (limit {max_ratio}x)")
+    return ratio <= max_ratio
+
+
+def bench_docs_builder() -> bool:
+    """Check that compiling a report into Docs requests scales linearly with its block count."""
+    from docs_updater import build_requests
+    return check_linear(
+        "📝 build_requests", "blocks", lambda report: build_requests(report, 1),
+        synthetic_report, sizes=(1250, 2500, 5000, 10000),
+    )
+
+
+def synthetic_transcript(segments: int) -> dict:
+    """Auto-caption style transcript: rolling overlap, tags, filler and the odd sponsor read."""
+    lines = [
+        "[Music]",
+        "um so today we're going",
+        "today we're going to talk about",
+        "to talk about vector databases and uh",
+        "and uh how the index is built",
+        "this video is sponsored by Example VPN",
+    ]
+    return {
+        "video_id": "synthetic",
+        "segments": [
+            {"text": f"{lines[i % len(lines)]} {i}", "start": i * 2.0, "duration": 2.0}
+            for i in range(segments)
+        ],
+    }
+
+
+def bench_preprocess() -> bool:
+    """Check that transcript preprocessing is linear in transcript size."""
+    from transcript_preprocess import preprocess_transcript
+    return check_linear(
+        "🧹 preprocess_transcript", "segments", preprocess_transcript,
+        synthetic_transcript, sizes=(5000, 10000, 20000, 40000),
+    )
+
+
+def bench_transcript_io(segments: int = 20000, min_reduction: float = 100) -> bool:
+    """Compare per-segment write+flush (the old youtube_transcripts loop) with BufferedStreamWriter."""
+    import tempfile
+    from buffered_io import BufferedStreamWriter
+
+    texts = [f"segment {i} of a long auto-generated\ncaption" for i in range(segments)]
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        with open(os.path.join(tmp, "unbuffered.txt"), "w", encoding="utf-8") as f:
+            for text in texts:
+                f.write(text)
+                f.flush()
+        unbuffered_seconds, unbuffered_writes = time.perf_counter() - start, segments
+
+        start = time.perf_counter()
+        with BufferedStreamWriter(os.path.join(tmp, "buffered.txt")) as writer:
+            for text in texts:
+                writer.write(" ".join(text.split()) + " ")
+        buffered_seconds, buffered_writes = time.perf_counter() - start, writer.flushes
+
+    reduction = unbuffered_writes / max(1, buffered_writes)
+    print(f"💽 {segments} segments: write+flush per segment {unbuffered_writes} writes in {unbuffered_seconds * 1000:.0f} ms, "
+          f"buffered {buffered_writes} writes in {buffered_seconds * 1000:.0f} ms ({reduction:.0f}x fewer syscalls)")
+    return reduction >= min_reduction
+
+
+def bench_pipeline(videos: int = 50, latency_scale: float = 0.1, max_peak_mb: float = 256) -> bool:
+    """Run the whole pipeline end-to-end against the offline fakes in benchmark_fakes.py."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "benchmark_fakes.py", "--videos", str(videos), "--latency-scale", str(latency_scale), "--json"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        return False
+    from benchmark_fakes import format_result
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    print(format_result(stats))
+    return (
+        stats["converted_videos"] == videos
+        and stats["docs_reports"] == videos
+        and stats["peak_memory_mb"] <= max_peak_mb
+    )
+
+
+def bench_dedup(sizes=(1000, 8000), lookups: int = 200, max_ratio: float = 2.0) -> bool:
+    """
+    Check that a dedup lookup doesn't slow down with the index size, and that
+    a lightly edited transcript is found while an unrelated one isn't.
+    """
+    import random
+    import tempfile
+    from array import array
+    from dedup import band_buckets, minhash, shingle_hashes, similarity
+    from config import DEDUP_NUM_PERM, DEDUP_THRESHOLD
+    from videos_controller import VideoRepository
+
+    rng = random.Random(0)
+    vocabulary = [f"w{i}" for i in range(5000)]
+
+    def text(words=1500):
+        return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+    original = text()
+    edited = original.split()
+    for i in rng.sample(range(len(edited)), len(edited) // 100):  # 1% of words changed: the re-upload case
+        edited[i] = rng.choice(vocabulary)
+    signatures = {name: minhash(shingle_hashes(t)) for name, t in
+                  (("original", original), ("edited", " ".join(edited)), ("unrelated", text()))}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        repository = VideoRepository(os.path.join(tmp, "dedup.db"))
+        repository.save_signature("original", 0, signatures["original"].tobytes(), band_buckets(signatures["original"]))
+        found = {name: {video_id for video_id, _ in repository.bucket_candidates(band_buckets(signature))}
+                 for name, signature in signatures.items() if name != "original"}
+        score = similarity(signatures["original"], signatures["edited"])
+        print(f"🧬 edited copy {score:.0%} similar, found: {'original' in found['edited']}; "
+              f"unrelated found: {'original' in found['unrelated']}")
+        ok = "original" in found["edited"] and score >= DEDUP_THRESHOLD and "original" not in found["unrelated"]
+
+        # Unrelated transcripts have independent signatures, so random ones stand in for them
+        per_lookup = []
+        indexed = 1
+        queries = [array("Q", (rng.getrandbits(61) for _ in range(DEDUP_NUM_PERM))) for _ in range(lookups)]
+        for size in sizes:
+            for i in range(indexed, size):
+                signature = array("Q", (rng.getrandbits(61) for _ in range(DEDUP_NUM_PERM)))
+                repository.save_signature(f"v{i}", 0, signature.tobytes(), band_buckets(signature))
+            indexed = size
+            best = min(_timed(lambda: [repository.bucket_candidates(band_buckets(q)) for q in queries]) for _ in range(3))
+            per_lookup.append(best / lookups * 1e6)
+            print(f"🧬 dedup lookup with {size:>6} indexed transcripts: {per_lookup[-1]:.0f} µs")
+        repository.close()
+
+    ratio = per_lookup[-1] / per_lookup[0]
+    print(f"   lookup cost at {sizes[-1]} vs {sizes[0]} transcripts: {ratio:.2f}x (limit {max_ratio}x)")
+    return ok and ratio <= max_ratio
+
+
+def _timed(fn, *args) -> float:
+    """Wall time of one call with the garbage collector paused, as timeit does."""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "docs_builder": bench_docs_builder,
+    "transcript_io": bench_transcript_io,
+    "preprocess": bench_preprocess,
+    "pipeline": bench_pipeline,
+    "dedup": bench_dedup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(sorted(unknown))}")
+    ok = True
+    for name in args.benchmarks or BENCHMARKS:
+        ok = BENCHMARKS[name]() and ok
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,481 @@
+"""
+Offline stand-ins for YouTube, Gemini, edge-tts and Google Docs, and a harness
+that runs the real pipeline end-to-end against them:
+
+    python benchmark_fakes.py --videos 100 --failure-rate 0.05
+
+The fakes replace the SDK modules in sys.modules and the settings come from
+config_template.py, injected as the `config` module with every path pointed
+at a temporary directory. No credentials, network access or config.py are
+needed, so it can run in CI. Each fake has its own latency, chunk size and
+failure rate, and Gemini and Docs can enforce a quota (see FakeSettings).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import zlib
+from dataclasses import dataclass, fields
+
+
+@dataclass
+class FakeSettings:
+    youtube_latency: float = 0.05
+    transcript_latency: float = 0.3
+    transcript_segments: int = 600
+    transcript_failure_rate: float = 0.0
+    gemini_first_token_latency: float = 0.8
+    gemini_chunk_latency: float = 0.03
+    gemini_chunk_chars: int = 120
+    gemini_response_chars: int = 4000
+    gemini_failure_rate: float = 0.0
+    gemini_quota_rps: float = 0.0  # requests/s above which the fake answers 429, 0 for no limit
+    tts_latency_per_1k_chars: float = 0.4
+    tts_failure_rate: float = 0.0
+    docs_latency: float = 0.15
+    docs_failure_rate: float = 0.0
+    docs_quota_rps: float = 0.0
+
+
+settings = FakeSettings()
+_random = random.Random(0)
+_random_lock = threading.Lock()
+
+WORDS = ("model inference latency token batch cache vector index embedding attention "
+         "throughput quantization kernel memory gradient shard replica queue").split()
+
+
+def _chance(rate: float) -> bool:
+    with _random_lock:
+        return rate > 0 and _random.random() < rate
+
+
+class ServerQuota:
+    """Server-side rate limit: more than `rps` requests in the last second get a 429."""
+
+    def __init__(self, setting: str):
+        self.setting = setting
+        self._requests = []
+        self._lock = threading.Lock()
+
+    def exceeded(self) -> bool:
+        rps = getattr(settings, self.setting)
+        if not rps:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._requests = [t for t in self._requests if t > now - 1]
+            if len(self._requests) >= rps:
+                return True
+            self._requests.append(now)
+            return False
+
+
+def _sentence(seed: int, words: int = 8) -> str:
+    return " ".join(WORDS[(seed * 7 + i * 3) % len(WORDS)] for i in range(words))
+
+
+# === YouTube transcripts ===
+
+class FakeSnippet:
+    __slots__ = ("text", "start", "duration")
+
+    def __init__(self, text, start, duration):
+        self.text, self.start, self.duration = text, start, duration
+
+
+class FakeFetchedTranscript(list):
+    language_code = "en"
+    is_generated = True
+
+
+class FakeYouTubeTranscriptApi:
+    def fetch(self, video_id, languages=("en",)):
+        time.sleep(settings.transcript_latency)
+        if _chance(settings.transcript_failure_rate):
+            raise RuntimeError(f"fake transcript fetch failed for {video_id}")
+        transcript = FakeFetchedTranscript()
+        previous_tail = ""
+        offset = sum(map(ord, video_id))  # distinct text per video, so the LLM cache doesn't short-circuit
+        for i in range(settings.transcript_segments):
+            # Rolling auto-caption shape: each line repeats the end of the previous one
+            text = f"{previous_tail} um {_sentence(offset + i, 6)} {video_id}".strip()
+            if i % 50 == 0:
+                text = "[Music] " + text
+            previous_tail = " ".join(text.split()[-3:])
+            transcript.append(FakeSnippet(text, i * 2.0, 2.0))
+        return transcript
+
+
+# === Gemini ===
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResourceExhausted(Exception):
+    code = 429
+
+
+class FakeGenerativeModel:
+    quota = ServerQuota("gemini_quota_rps")
+
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False, generation_config=None):
+        chunks = self._chunks(zlib.crc32(prompt.encode("utf-8")) % 1000)
+        if stream:
+            return chunks
+        return FakeChunk("".join(chunk.text for chunk in chunks))
+
+    def _chunks(self, seed):
+        if self.quota.exceeded():
+            raise FakeResourceExhausted(f"fake {self.model_name} quota exceeded")
+        time.sleep(settings.gemini_first_token_latency)
+        if _chance(settings.gemini_failure_rate):
+            raise RuntimeError(f"fake {self.model_name} failure")
+        # Markdown shaped like a report, so the docs stage has real work to do
+        parts, size, n = [], 0, 0
+        while size < settings.gemini_response_chars:
+            line = (f"## Section {n}\n" if n % 6 == 0 else f"- **{WORDS[n % len(WORDS)]}** {_sentence(seed + n)}\n")
+            parts.append(line)
+            size += len(line)
+            n += 1
+        text = "".join(parts)
+        for start in range(0, len(text), settings.gemini_chunk_chars):
+            if start:
+                time.sleep(settings.gemini_chunk_latency)
+            yield FakeChunk(text[start:start + settings.gemini_chunk_chars])
+
+
+# === edge-tts ===
+
+class NoAudioReceived(Exception):
+    pass
+
+
+class WebSocketError(Exception):
+    pass
+
+
+class FakeCommunicate:
+    def __init__(self, text, voice, **kwargs):
+        self.text, self.voice = text, voice
+
+    async def save(self, path):
+        await asyncio.sleep(len(self.text) / 1000 * settings.tts_latency_per_1k_chars)
+        if _chance(settings.tts_failure_rate):
+            raise NoAudioReceived("fake: no audio received")
+        with open(path, "wb") as f:
+            f.write(b"\xff\xf3" * (len(self.text) * 4))
+
+
+class FakeClientError(Exception):
+    pass
+
+
+class FakeWSServerHandshakeError(FakeClientError):
+    pass
+
+
+# === YouTube Data API and Google Docs ===
+
+class FakeHttpError(Exception):
+    def __init__(self, resp, content=b"", uri=None):
+        super().__init__(f"<HttpError {resp.status}>")
+        self.resp, self.content = resp, content
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeRequest:
+    def __init__(self, run):
+        self._run = run
+
+    def execute(self, http=None, num_retries=0):
+        return self._run()
+
+
+class FakeYouTube:
+    """Serves one uploads playlist holding `videos` synthetic videos, 50 per page."""
+
+    def __init__(self, videos):
+        now = time.time()
+        self.items = [
+            {
+                "contentDetails": {
+                    "videoId": f"vid{i:05d}",
+                    "videoPublishedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - 60 * (i + 1))),
+                },
+                "snippet": {
+                    "title": f"Synthetic talk {i}",
+                    "description": _sentence(i, 20),
+                    "publishedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - 60 * (i + 1))),
+                },
+            }
+            for i in range(videos)
+        ]
+
+    def channels(self):
+        return self
+
+    def playlistItems(self):
+        return self
+
+    def list(self, part=None, id=None, playlistId=None, maxResults=50, pageToken=None):
+        def run():
+            time.sleep(settings.youtube_latency)
+            if id is not None:
+                return {"items": [{"contentDetails": {"relatedPlaylists": {"uploads": "UU" + id[2:]}}}]}
+            start = int(pageToken or 0)
+            response = {"items": self.items[start:start + maxResults]}
+            if start + maxResults < len(self.items):
+                response["nextPageToken"] = str(start + maxResults)
+            return response
+        return FakeRequest(run)
+
+
+class FakeDocs:
+    """Tracks the document's length so end-index reads and inserts stay consistent."""
+
+    def __init__(self):
+        self.length = 1
+        self.batches = 0
+        self.quota = ServerQuota("docs_quota_rps")
+        self._lock = threading.Lock()
+
+    def documents(self):
+        return self
+
+    def get(self, documentId, fields=None):
+        return FakeRequest(lambda: {"body": {"content": [{"endIndex": self.length + 1}]}})
+
+    def batchUpdate(self, documentId, body):
+        def run():
+            if self.quota.exceeded():
+                raise FakeHttpError(FakeResponse(429))
+            time.sleep(settings.docs_latency)
+            if _chance(settings.docs_failure_rate):
+                raise FakeHttpError(FakeResponse(503))
+            with self._lock:
+                for request in body["requests"]:
+                    text = request.get("insertText", {}).get("text", "")
+                    self.length += len(text.encode("utf-16-le")) // 2
+                self.batches += 1
+            return {"replies": [{} for _ in body["requests"]]}
+        return FakeRequest(run)
+
+
+def install_fakes(videos: int) -> dict:
+    """Register the fake SDK modules in sys.modules. Returns the fake service objects."""
+    youtube, docs = FakeYouTube(videos), FakeDocs()
+
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    def build(service, version, developerKey=None, credentials=None, **kwargs):
+        return youtube if service == "youtube" else docs
+
+    credentials = types.SimpleNamespace(from_service_account_file=lambda *args, **kwargs: object())
+    module("youtube_transcript_api", YouTubeTranscriptApi=FakeYouTubeTranscriptApi)
+    generativeai = module("google.generativeai", configure=lambda **kwargs: None, GenerativeModel=FakeGenerativeModel)
+    service_account = module("google.oauth2.service_account", Credentials=credentials)
+    oauth2 = module("google.oauth2", service_account=service_account, __path__=[])
+    module("google", generativeai=generativeai, oauth2=oauth2, __path__=[])
+    discovery = module("googleapiclient.discovery", build=build)
+    errors = module("googleapiclient.errors", HttpError=FakeHttpError)
+    module("googleapiclient", discovery=discovery, errors=errors, __path__=[])
+    module("httplib2", Http=lambda *args, **kwargs: None)
+    exceptions = module("edge_tts.exceptions", NoAudioReceived=NoAudioReceived, WebSocketError=WebSocketError)
+    module("edge_tts", Communicate=FakeCommunicate, exceptions=exceptions, __path__=[])
+    module("aiohttp", ClientError=FakeClientError, WSServerHandshakeError=FakeWSServerHandshakeError)
+    return {"youtube": youtube, "docs": docs}
+
+
+def install_config(workdir: str, **overrides) -> types.ModuleType:
+    """Load config_template.py as the `config` module, with every file path inside `workdir`."""
+    template = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config_template.py")
+    config = types.ModuleType("config")
+    config.__file__ = template
+    with open(template, "r", encoding="utf-8") as f:
+        exec(compile(f.read(), template, "exec"), config.__dict__)
+    folders = {
+        "CACHE_FOLDER": "cache",
+        "VOICE_NOTES_FOLDER": "voice_notes",
+        "TRANSCRIPT_CACHE_FOLDER": "transcripts",
+        "TTS_CACHE_FOLDER": "tts_cache",
+    }
+    for name, folder in folders.items():
+        path = os.path.join(workdir, folder)
+        os.makedirs(path, exist_ok=True)
+        setattr(config, name, path)
+    config.LLM_CACHE_DB_PATH = os.path.join(workdir, "llm_cache.db")
+    config.METRICS_PATH = os.path.join(workdir, "metrics.jsonl")
+    config.CHANNEL_IDS = ["UCbenchmark"]
+    config.SYNC_BACKFILL_ALL = True
+    config.YOUTUBE_DAILY_QUOTA = 10 ** 9
+    config.DOCS_REPORTS = True
+    config.DOCUMENT_ID = "benchmark-document"
+    # Retries should cost fake time, not real minutes
+    config.JOB_RETRY_BASE_SECONDS = 0.01
+    config.TTS_RETRY_BASE_SECONDS = 0.01
+    config.DOCS_RETRY_BASE_SECONDS = 0.01
+    config.DAEMON_HEALTH_PORT = 0
+    # Let the fakes' own quotas (--gemini-quota-rps, ...) be what the rate limiters adapt to
+    config.RATE_LIMITS = {
+        service: {"rate": 20, "min_rate": 0.5, "max_rate": 100, "burst": 20}
+        for service in ("youtube", "transcripts", "gemini", "edge_tts", "docs")
+    }
+    config.YOUTUBE_RETRY_BASE_SECONDS = 0.01
+    config.GEMINI_RETRY_BASE_SECONDS = 0.05
+    config.__dict__.update(overrides)
+    sys.modules["config"] = config
+    return config
+
+
+def _setup(videos: int, workdir: str, config_overrides=None):
+    install_fakes(videos)
+    install_config(workdir, **(config_overrides or {}))
+    import videos_controller
+    videos_controller.DB_PATH = os.path.join(workdir, "youtube_video_data.db")
+
+
+def settings_argv() -> list:
+    """Command-line flags that reproduce the current FakeSettings in a child process."""
+    return [arg for field in fields(FakeSettings)
+            for arg in (f"--{field.name.replace('_', '-')}", str(getattr(settings, field.name)))]
+
+
+def run_benchmark(videos: int = 50, quiet: bool = True, workers: int = 0, config_overrides=None) -> dict:
+    """
+    Run the real pipeline over `videos` synthetic videos against the fakes and collect results.
+
+    With `workers`, the backlog is processed by `main.py workers`-style worker
+    processes (each one installs the fakes itself) instead of in this process.
+    `config_overrides` reach them as JSON, so their values must be JSON-serialisable.
+    """
+    workdir = tempfile.mkdtemp(prefix="youtube_summariser_bench_")
+    _setup(videos, workdir, config_overrides)
+    import main
+    import metrics
+    from pipeline import run_stats
+
+    output = io.StringIO()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        if workers:
+            from workers import run_coordinator
+            worker_command = [sys.executable, os.path.abspath(__file__), "--videos", str(videos),
+                              "--worker-workdir", workdir, *settings_argv(), *([] if quiet else ["--verbose"]),
+                              *(["--config-overrides", json.dumps(config_overrides)] if config_overrides else [])]
+            stats = run_coordinator(workers, worker_command=worker_command)
+        else:
+            main.run_once()
+            stats = run_stats
+    seconds = time.perf_counter() - started_at
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    spans, counters = metrics.aggregate(metrics.load_events())
+    return {
+        "videos": videos,
+        "workers": workers,
+        "seconds": round(seconds, 2),
+        "videos_per_minute": round(videos / seconds * 60, 1),
+        "peak_memory_mb": round(peak_bytes / 1e6, 1),
+        # Largest worker process (Linux reports ru_maxrss in KB)
+        "worker_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1e3, 1) if workers else 0,
+        **stats,
+        "docs_batches": int(spans["docs.append"]["totals"].get("batches", 0)) if "docs.append" in spans else 0,
+        "stages": {
+            name: {
+                "count": len(span["seconds"]),
+                "errors": span["errors"],
+                "p50": metrics.percentile(span["seconds"], 50),
+                "p95": metrics.percentile(span["seconds"], 95),
+            }
+            for name, span in sorted(spans.items())
+        },
+        "counters": {
+            name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+            for (name, labels), value in sorted(counters.items())
+        },
+        "workdir": workdir,
+    }
+
+
+def format_result(result: dict) -> str:
+    lines = [
+        f"🏁 {result['videos']} videos in {result['seconds']}s"
+        f"{' with ' + str(result['workers']) + ' workers' if result['workers'] else ''}: "
+        f"{result['videos_per_minute']} videos/min, peak Python memory {result['peak_memory_mb']} MB"
+        f"{', largest worker ' + str(result['worker_peak_rss_mb']) + ' MB RSS' if result['workers'] else ''}",
+        f"   {result['converted_videos']} voice notes, {result['docs_reports']} docs reports, "
+        f"{result['failed_conversions']} failed, {result['docs_batches']} Docs batches",
+        f"   {'span':<24}{'count':>7}{'errors':>8}{'p50 s':>9}{'p95 s':>9}",
+    ]
+    for name, stage in result["stages"].items():
+        lines.append(f"   {name:<24}{stage['count']:>7}{stage['errors']:>8}{stage['p50']:>9.2f}{stage['p95']:>9.2f}")
+    for name, value in result["counters"].items():
+        lines.append(f"   {name} {value:g}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline end-to-end against offline fakes.")
+    parser.add_argument("--videos", type=int, default=50)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every fake latency")
+    parser.add_argument("--failure-rate", type=float, default=None, help="failure rate for every fake service")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--workers", type=int, default=0, help="process the backlog with N worker processes")
+    # Set by the coordinator when it starts a worker
+    parser.add_argument("--worker-workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--stages", help=argparse.SUPPRESS)
+    parser.add_argument("--rate-share", type=float, default=1.0, help=argparse.SUPPRESS)
+    parser.add_argument("--config-overrides", type=json.loads, default=None, help=argparse.SUPPRESS)
+    for field in fields(FakeSettings):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(field.default), default=None)
+    args = parser.parse_args()
+
+    _random.seed(args.seed)
+    for field in fields(FakeSettings):
+        value = getattr(args, field.name)
+        if value is None and args.failure_rate is not None and field.name.endswith("_failure_rate"):
+            value = args.failure_rate
+        if value is None and "latency" in field.name:
+            value = field.default * args.latency_scale
+        if value is not None:
+            setattr(settings, field.name, value)
+
+    if args.worker_workdir:
+        # A worker process started by run_coordinator
+        _random.seed(args.seed + os.getpid())
+        _setup(args.videos, args.worker_workdir, args.config_overrides)
+        from workers import run_worker
+        with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+            run_worker(args.stages.split(","), rate_share=args.rate_share)
+        sys.exit(0)
+
+    result = run_benchmark(args.videos, quiet=not args.verbose, workers=args.workers)
+    print(json.dumps(result) if args.json else format_result(result))
@@ -1,4 +1,9 @@
 # config.py
+import os
+
+# Folder of this file; local data paths below are anchored here rather than to the working directory,
+# so runs started from elsewhere (cron, systemd) share the same caches and metrics
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # YouTube Data API Key - keep this private!
 YOUTUBE_API_KEY = "your_youtube_api_key_here"
@@ -21,4 +26,138 @@ DOCKUMENT_NAME="path/to/your/document_name"
 SERVICE_ACCOUNT_KEY_FILE="path/to/your/youtube_summarizer_service_account_key.json"
 
 # Google Gemini API Key
-GEMINI_API_KEY="gemini_api_key_here"
\ No newline at end of file
+GEMINI_API_KEY="gemini_api_key_here"
+
+# Local folders for generated summaries (.txt) and voice notes (.mp3)
+CACHE_FOLDER = os.path.join(BASE_DIR, "cache")
+VOICE_NOTES_FOLDER = os.path.join(BASE_DIR, "AIE_insights")
+
+# Pipeline concurrency - how many videos are in flight at once
+PIPELINE_CONCURRENCY = 4
+# Per-stage limits, keep these within each API's rate limits
+TRANSCRIPT_CONCURRENCY = 4  # YouTube transcript fetches
+GEMINI_CONCURRENCY = 2      # Gemini summary streams
+TTS_CONCURRENCY = 3         # edge-tts syntheses
+
+# Transcript store - each transcript is downloaded once and kept as <video_id>.<lang>.json
+TRANSCRIPT_CACHE_FOLDER = os.path.join(BASE_DIR, "transcripts")
+TRANSCRIPT_LANGUAGES = ["en"]  # preferred transcript languages, in order
+
+# Gemini response cache - reruns with an identical prompt don't call the API again
+LLM_CACHE_DB_PATH = os.path.join(BASE_DIR, "llm_cache.db")
+LLM_CACHE_MAX_BYTES = 200 * 1024 * 1024  # least recently used entries are evicted above this
+LLM_CACHE_TTL_HOURS = 24 * 30  # 0 disables expiry
+
+# Gemini fallback - per-model deadlines in seconds (first streamed chunk / whole response)
+MODEL_TIMEOUTS = {
+    "gemini-2.5-pro": {"first_token": 90, "total": 900},
+    "gemini-2.5-flash": {"first_token": 45, "total": 450},
+    "gemini-2.5-flash-lite": {"first_token": 30, "total": 300},
+}
+DEFAULT_MODEL_TIMEOUT = {"first_token": 60, "total": 600}
+# Start the next model in parallel if there's no first chunk after N seconds (0 disables hedging)
+MODEL_HEDGE_AFTER_SECONDS = 0
+# Skip a model after this many consecutive failures (0 disables)...
+MODEL_CIRCUIT_BREAKER_THRESHOLD = 3
+# ...for this long; then calls go through again, and the next failure skips it for another cooldown
+MODEL_CIRCUIT_BREAKER_COOLDOWN_SECONDS = 300
+
+# Summary models, in order of preference
+SUMMARY_MODELS = ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite"]
+
+# Map-reduce summarisation for long transcripts (token counts are estimates, ~4 chars/token)
+MAP_REDUCE_THRESHOLD_TOKENS = 60000  # transcripts above this are summarised in chunks
+MAP_REDUCE_CHUNK_TOKENS = 12000      # target size of each chunk
+MAP_MODELS = ["gemini-2.5-flash-lite", "gemini-2.5-flash"]  # cheap models for the chunk notes
+MAP_CONCURRENCY = 4                  # chunks summarised at once per video
+
+# edge-tts retries - transient network failures are retried with exponential backoff
+TTS_MAX_RETRIES = 4
+TTS_RETRY_BASE_SECONDS = 2
+
+# Long scripts are synthesised as sentence/paragraph segments in parallel and joined into one mp3
+TTS_SEGMENT_MAX_CHARS = 1500
+TTS_SEGMENT_CONCURRENCY = 4  # segments synthesised at once per voice note
+
+# Voice per video - pinned here, otherwise picked deterministically from the video id
+VOICE_OVERRIDES = {}  # e.g. {"dQw4w9WgXcQ": "Jenny"}
+
+# Synthesised audio cache keyed by (text hash, voice), so reruns just link the existing mp3
+TTS_CACHE_FOLDER = os.path.join(BASE_DIR, "tts_cache")
+TTS_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+TTS_CACHE_MAX_AGE_DAYS = 90  # 0 disables age-based eviction
+
+# Incremental channel sync (uploads playlist, 1 quota unit per 50 videos)
+SYNC_BACKFILL_ALL = False  # first sync of a channel fetches its whole history instead of LOOKBACK_HOURS
+SYNC_MAX_PAGES = 200       # safety cap on pages per sync (50 videos per page)
+YOUTUBE_DAILY_QUOTA = 10000  # stop syncing once today's recorded usage reaches this
+
+# Channels to follow - when empty, only CHANNEL_ID is polled
+CHANNEL_IDS = []  # e.g. ["UCxxxx", "UCyyyy"]
+# Each channel is polled about 4x per its typical upload gap, within these bounds
+CHANNEL_POLL_MIN_MINUTES = 15
+CHANNEL_POLL_MAX_MINUTES = 24 * 60
+CHANNEL_SYNC_CONCURRENCY = 8  # channels polled at once
+
+# Job queue - every video stage (transcript, summary, tts) is a durable job in the DB
+JOB_MAX_ATTEMPTS = 5         # attempts per stage before the job is marked failed
+JOB_RETRY_BASE_SECONDS = 60  # backoff before a failed stage is retried (doubles per attempt)
+JOB_LEASE_SECONDS = 600      # a running job whose worker stops heartbeating is reclaimed after this
+
+# Daemon mode (python main.py serve)
+DAEMON_POLL_SECONDS = 60    # how often to check which channels are due (see CHANNEL_POLL_MIN/MAX_MINUTES)
+DAEMON_HEALTH_PORT = 8787   # /healthz and /status on 127.0.0.1, 0 disables
+
+# Google Docs writes - requests are sent in bounded batches, 429/5xx responses are retried with backoff
+DOCS_BATCH_MAX_REQUESTS = 200
+DOCS_BATCH_MAX_CHARS = 100000  # text inserted per batchUpdate call
+DOCS_MAX_RETRIES = 5
+DOCS_RETRY_BASE_SECONDS = 1
+
+# Engineer-oriented Markdown report per video, appended to DOCUMENT_ID alongside the voice note
+DOCS_REPORTS = False
+DOCS_REPORT_MODELS = ["gemini-2.5-pro", "gemini-2.5-flash"]
+
+# Streamed file output is buffered and written in one go per this many characters or seconds
+STREAM_FLUSH_CHARS = 64 * 1024
+STREAM_FLUSH_SECONDS = 1.0
+
+# Transcript clean-up before prompting: strips [Music]-style tags, filler words and repeated auto-caption text
+TRANSCRIPT_PREPROCESS = True
+TRANSCRIPT_DROP_SPONSOR_SEGMENTS = False  # also skip whole segments with sponsor/call-to-action phrases (drops content)
+
+# Run metrics - spans and counters appended as JSON lines ("" disables), see `python main.py report`
+METRICS_PATH = os.path.join(BASE_DIR, "metrics.jsonl")
+
+# Outbound rate limits per service (requests/second). Each starts at `rate` and adapts between
+# `min_rate` and `max_rate`: raised a little on every success, cut on every 429
+RATE_LIMITS = {
+    "youtube": {"rate": 5, "min_rate": 0.5, "max_rate": 20, "burst": 10},     # YouTube Data API
+    "transcripts": {"rate": 1, "min_rate": 0.1, "max_rate": 5, "burst": 2},   # transcript downloads
+    "gemini": {"rate": 1, "min_rate": 0.05, "max_rate": 5, "burst": 2},
+    "edge_tts": {"rate": 3, "min_rate": 0.2, "max_rate": 10, "burst": 4},
+    "docs": {"rate": 1, "min_rate": 0.1, "max_rate": 5, "burst": 3},          # Docs allows 60 writes/min
+}
+RATE_LIMIT_INCREASE_STEP = 0.01  # fraction of max_rate added per success
+RATE_LIMIT_BACKOFF_FACTOR = 0.5  # rate multiplier on a throttled response
+# Retries across all services: at most this share of recent calls, plus a small floor per second
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_PER_SECOND = 0.5
+YOUTUBE_MAX_RETRIES = 4
+YOUTUBE_RETRY_BASE_SECONDS = 1
+GEMINI_MAX_RETRIES = 2  # per model, on 429/5xx before any text has streamed; then the next model is tried
+GEMINI_RETRY_BASE_SECONDS = 5
+
+# Worker mode (python main.py workers): worker processes share the job queue in the DB file
+WORKER_PROCESSES = 0           # 0 = one per CPU core
+WORKER_HEARTBEAT_SECONDS = 5
+WORKER_STALE_SECONDS = 60      # a worker silent this long is presumed dead and its jobs are handed out again
+WORKER_MAX_RESPAWNS = 3        # per worker slot, after a crash
+
+# Near-duplicate detection at ingest (re-uploads, replays): a video whose transcript is at least
+# DEDUP_THRESHOLD similar (estimated Jaccard over word shingles) to an already voiced one reuses its voice note
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.8
+DEDUP_SHINGLE_WORDS = 5
+DEDUP_NUM_PERM = 128   # MinHash signature length (bins); changing it or DEDUP_BANDS needs `python main.py dedup --rebuild`
+DEDUP_BANDS = 32       # LSH bands, must divide DEDUP_NUM_PERM; more bands find less similar pairs
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+from config import DAEMON_HEALTH_PORT, DAEMON_POLL_SECONDS, GEMINI_API_KEY
+from job_queue import JobQueue
+from pipeline import enqueue_pending_videos, run_pipeline, run_stats
+from videos_controller import build_youtube_client, create_db, sync_subscribed_channels
+
+
+class PipelineDaemon:
+    """
+    Long-running pipeline: polls subscribed channels on a schedule and keeps a
+    pool of workers draining the job queue, so new uploads are processed as
+    soon as a sync sees them. API clients are built once and stay warm.
+    """
+
+    def __init__(self, poll_seconds: float = DAEMON_POLL_SECONDS, health_port: int = DAEMON_HEALTH_PORT):
+        self.poll_seconds = poll_seconds
+        self.health_port = health_port
+        self.job_queue = JobQueue()
+        self.status = {
+            "state": "starting",
+            "started_at": time.time(),
+            "last_sync_at": None,
+            "last_sync_new_videos": 0,
+            "syncs": 0,
+            "last_error": None,
+        }
+        self._stop_event = None
+        self._http_server = None
+
+    def snapshot(self) -> dict:
+        """Status for the health endpoint."""
+        jobs = {}
+        for (stage, state), count in self.job_queue.counts().items():
+            jobs.setdefault(stage, {})[state] = count
+        return {
+            **self.status,
+            "uptime_seconds": round(time.time() - self.status["started_at"], 1),
+            "converted_videos": run_stats["converted_videos"],
+            "failed_conversions": run_stats["failed_conversions"],
+            "deduplicated_videos": run_stats["deduplicated_videos"],
+            "jobs": jobs,
+        }
+
+    def stop(self):
+        if self._stop_event is not None and not self._stop_event.is_set():
+            print("\n🛑 Shutting down: finishing in-flight jobs...")
+            self.status["state"] = "stopping"
+            self._stop_event.set()
+
+    async def _sync_loop(self, youtube):
+        while not self._stop_event.is_set():
+            try:
+                _, new_count = await asyncio.to_thread(sync_subscribed_channels, False, youtube)
+                queued = await asyncio.to_thread(enqueue_pending_videos, self.job_queue)
+                self.status.update(
+                    last_sync_at=time.time(),
+                    last_sync_new_videos=new_count,
+                    syncs=self.status["syncs"] + 1,
+                )
+                if queued:
+                    print(f"📥 Queued {queued} new jobs")
+            except Exception as e:
+                self.status["last_error"] = f"sync: {e}"
+                print(f"❌ Sync failed: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        self._stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        import google.generativeai as genai
+        create_db()
+        genai.configure(api_key=GEMINI_API_KEY)
+        youtube = build_youtube_client()
+        self._start_health_server()
+        self.status["state"] = "running"
+        print(f"🚀 Daemon started, checking for due channels every {self.poll_seconds}s")
+        try:
+            await asyncio.gather(
+                self._sync_loop(youtube),
+                run_pipeline(self.job_queue, stop_event=self._stop_event),
+            )
+        finally:
+            if self._http_server is not None:
+                self._http_server.shutdown()
+            self.status["state"] = "stopped"
+            print("👋 Daemon stopped.")
+
+    def _start_health_server(self):
+        if not self.health_port:
+            return
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/healthz":
+                    healthy = daemon.status["state"] == "running"
+                    self._send(200 if healthy else 503, {"status": "ok" if healthy else daemon.status["state"]})
+                elif self.path == "/status":
+                    self._send(200, daemon.snapshot())
+                elif self.path == "/metrics":
+                    body = metrics.format_prometheus(metrics.recent_events()).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def _send(self, code, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep health checks out of the pipeline log
+
+        self._http_server = ThreadingHTTPServer(("127.0.0.1", self.health_port), HealthHandler)
+        threading.Thread(target=self._http_server.serve_forever, daemon=True).start()
+        print(f"🩺 Health endpoint on http://127.0.0.1:{self.health_port}/healthz, /status and /metrics")
+
+
+def serve():
+    """Run the pipeline as a daemon until SIGINT/SIGTERM."""
+    asyncio.run(PipelineDaemon().run())
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,163 @@
+import hashlib
+import re
+from array import array
+
+import metrics
+from config import DEDUP_BANDS, DEDUP_NUM_PERM, DEDUP_SHINGLE_WORDS, DEDUP_THRESHOLD
+from transcript_preprocess import preprocess_transcript
+from transcript_store import load_transcript, transcript_text
+from videos_controller import get_repository
+
+ROWS_PER_BAND = DEDUP_NUM_PERM // DEDUP_BANDS
+# Shingle hashes are 64-bit, so a bin's value is below 2**64 / DEDUP_NUM_PERM; the densification offset keeps
+# values borrowed from another bin apart from the bin's own
+DENSIFY_OFFSET = (1 << 64) // DEDUP_NUM_PERM
+WORD_RE = re.compile(r"\w+")
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def shingle_hashes(text: str) -> set:
+    """Hashes of every DEDUP_SHINGLE_WORDS-word window of the lower-cased words in `text`."""
+    words = WORD_RE.findall(text.lower())
+    size = min(DEDUP_SHINGLE_WORDS, len(words))
+    if not size:
+        return set()
+    return {
+        _hash64(" ".join(words[i:i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    }
+
+
+def minhash(hashes) -> array:
+    """
+    MinHash signature of a set of shingle hashes, by one-permutation hashing:
+    each hash goes to one of DEDUP_NUM_PERM bins and the bin keeps its minimum,
+    so the signature costs one pass over the shingles instead of one per
+    permutation. Empty bins (short transcripts) borrow the next non-empty
+    bin's value, offset by the distance.
+    """
+    bins = [None] * DEDUP_NUM_PERM
+    for h in hashes:
+        index, value = h % DEDUP_NUM_PERM, h // DEDUP_NUM_PERM
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    filled = [i for i, value in enumerate(bins) if value is not None]
+    if len(filled) < DEDUP_NUM_PERM:
+        for i, value in enumerate(bins):
+            if value is None:
+                distance = min((j - i) % DEDUP_NUM_PERM for j in filled)
+                bins[i] = bins[(i + distance) % DEDUP_NUM_PERM] + distance * DENSIFY_OFFSET
+    return array("Q", bins)
+
+
+def band_buckets(signature: array) -> list:
+    """(band, bucket) keys for LSH: signatures agreeing on every row of any band land in the same bucket."""
+    return [
+        (band, int.from_bytes(
+            hashlib.blake2b(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes(), digest_size=8).digest(),
+            "little", signed=True,  # SQLite integers are signed 64-bit
+        ))
+        for band in range(DEDUP_BANDS)
+    ]
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def transcript_signature(transcript: dict) -> tuple:
+    """(shingle count, MinHash signature) of a cleaned-up transcript; the signature is None if it has no words."""
+    hashes = shingle_hashes(transcript_text(preprocess_transcript(transcript)))
+    return len(hashes), (minhash(hashes) if hashes else None)
+
+
+def index_transcript(video_id: str, transcript: dict) -> bool:
+    """Add a transcript to the index. False if it has no words to index."""
+    shingle_count, signature = transcript_signature(transcript)
+    if signature is None:
+        return False
+    get_repository().save_signature(video_id, shingle_count, signature.tobytes(), band_buckets(signature))
+    return True
+
+
+def check_duplicate(video_id: str, transcript: dict) -> dict | None:
+    """
+    Look a transcript up in the dedup index at ingest.
+
+    Only videos sharing an LSH bucket are compared, so the lookup reads a
+    handful of index rows however many transcripts are indexed. If the most
+    similar one is at least DEDUP_THRESHOLD alike and already has a voice
+    note, the video is marked as its duplicate and the original's row is
+    returned; the pipeline then links that voice note instead of summarising
+    again. Otherwise the transcript is added to the index and None returned.
+    The decision is printed and recorded as a "dedup" metrics event.
+    """
+    repository = get_repository()
+    with metrics.timed("dedup.check") as span:
+        shingle_count, signature = transcript_signature(transcript)
+        if signature is None:
+            return None
+        buckets = band_buckets(signature)
+        candidates = repository.bucket_candidates(buckets, exclude=video_id)
+        span["candidates"] = len(candidates)
+        scored = sorted(
+            ((similarity(signature, array("Q", stored)), candidate_id) for candidate_id, stored in candidates),
+            reverse=True,
+        )
+
+        decision, original, best = "unique", None, scored[0] if scored else (0.0, None)
+        for score, candidate_id in scored:
+            if score < DEDUP_THRESHOLD:
+                break
+            candidate = repository.get_video(candidate_id)
+            if candidate and candidate["voice_note_generated"]:
+                decision, original, best = "duplicate", candidate, (score, candidate_id)
+                break
+            # A match still in the pipeline has nothing to reuse yet, so this video is processed too
+            decision = "original_pending"
+
+        if original is not None:
+            repository.set_duplicate(video_id, original["video_id"], round(best[0], 4))
+        else:
+            repository.save_signature(video_id, shingle_count, signature.tobytes(), buckets)
+
+    metrics.record(
+        "dedup", video_id=video_id, decision=decision, similarity=round(best[0], 4),
+        match=best[1], candidates=len(candidates), threshold=DEDUP_THRESHOLD,
+    )
+    if original is not None:
+        print(f"🧬 {video_id} is a near-duplicate of {original['video_id']} ({best[0]:.0%} similar), reusing its voice note")
+    elif best[1] is not None:
+        print(f"🧬 {video_id}: closest indexed transcript is {best[1]} ({best[0]:.0%} similar), {decision}")
+    return original
+
+
+def unlink_duplicate(video_id: str, original_id: str, transcript: dict):
+    """A duplicate whose original voice note is gone becomes an original itself, indexed like any other."""
+    get_repository().set_duplicate(video_id, None, None)
+    index_transcript(video_id, transcript)
+    metrics.record("dedup", video_id=video_id, decision="original_missing", match=original_id)
+    print(f"🧬 Voice note of {original_id} is missing, {video_id} will be summarised and voiced itself")
+
+
+def index_existing(rebuild: bool = False) -> int:
+    """
+    Add the cached transcripts of already voiced videos to the index, e.g.
+    those voiced before deduplication existed. With `rebuild` the index is
+    emptied first, needed after changing DEDUP_NUM_PERM, DEDUP_BANDS or
+    DEDUP_SHINGLE_WORDS. Returns how many transcripts were indexed.
+    """
+    repository = get_repository()
+    if rebuild:
+        repository.clear_signatures()
+    indexed = 0
+    for video_id in repository.videos_without_signature():
+        transcript = load_transcript(video_id)
+        if transcript is not None and index_transcript(video_id, transcript):
+            indexed += 1
+    print(f"🧬 Indexed {indexed} transcripts for deduplication")
+    return indexed
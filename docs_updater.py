@@ -1,18 +1,27 @@
-import os
-import re
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from config import DOCUMENT_ID, SERVICE_ACCOUNT_KEY_FILE
-from md2docs import markdown_to_document_structure
+import contextlib
+import hashlib
+import json
+import threading
+from config import (
+    DOCUMENT_ID,
+    SERVICE_ACCOUNT_KEY_FILE,
+    DOCS_BATCH_MAX_REQUESTS,
+    DOCS_BATCH_MAX_CHARS,
+    DOCS_MAX_RETRIES,
+    DOCS_RETRY_BASE_SECONDS,
+)
+import metrics
+import rate_limit
+from md2docs import parse_inline
 # OAuth scopes required for Docs API (for editing/creating documents)
 SCOPES = [
     'https://www.googleapis.com/auth/documents',
     'https://www.googleapis.com/auth/drive.file' # Needed if you also create docs
 ]
-
 def authenticate_docs_api():
     """Authenticates with Google Docs API using a service account."""
+    from google.oauth2.service_account import Credentials
+    from googleapiclient.discovery import build
     try:
         credentials = Credentials.from_service_account_file(
             SERVICE_ACCOUNT_KEY_FILE, scopes=SCOPES
@@ -24,20 +33,33 @@ def authenticate_docs_api():
         print(f"Authentication failed: {e}")
         return None
 
+_service = None
+_service_lock = threading.Lock()
+
+def get_docs_service():
+    """Process-wide Docs API client, authenticated on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = authenticate_docs_api()
+        return _service
+
+def insertion_index(content):
+    """Safe insertion index just before the end of a document body."""
+    # Find the last element with a valid 'endIndex'
+    for element in reversed(content):
+        end_index = element.get('endIndex')
+        if end_index is not None:
+            # Subtract 1 to avoid inserting at the absolute end, which may be invalid
+            return max(1, end_index - 1)
+    return 1  # Fallback if no valid endIndex is found
+
 def get_document_length(service, document_id):
     """Returns a safe insertion index just before the end of the document."""
+    from googleapiclient.errors import HttpError
     try:
         doc = service.documents().get(documentId=document_id, fields='body.content').execute()
-        content = doc.get('body', {}).get('content', [])
-        
-        # Find the last element with a valid 'endIndex'
-        for element in reversed(content):
-            end_index = element.get('endIndex')
-            if end_index is not None:
-                # Subtract 1 to avoid inserting at the absolute end, which may be invalid
-                return max(1, end_index - 1)
-        
-        return 1  # Fallback if no valid endIndex is found
+        return insertion_index(doc.get('body', {}).get('content', []))
     except HttpError as err:
         print(f"Error getting document length: {err}")
         return 1
@@ -45,195 +67,308 @@ def get_document_length(service, document_id):
         print(f"An unexpected error occurred getting document length: {e}")
         return 1
 
+# Text styles a report can set; cleared on inserted text so it doesn't inherit the style before it
+RESET_TEXT_FIELDS = 'bold,italic,link,weightedFontFamily,backgroundColor'
+CODE_STYLE = {
+    'weightedFontFamily': {'fontFamily': 'Courier New'},
+    'backgroundColor': {'color': {'rgbColor': {'red': 0.95, 'green': 0.95, 'blue': 0.95}}},
+}
+BULLET_PRESETS = {False: 'BULLET_DISC_CIRCLE_SQUARE', True: 'NUMBERED_DECIMAL_ALPHA_ROMAN'}
+
+def utf16_len(text):
+    """Length in UTF-16 code units, which is how the Docs API counts indexes."""
+    return len(text) if text.isascii() else len(text.encode('utf-16-le')) // 2
+
+def _text_style(start, end, style):
+    """updateTextStyle request for an inline run style from md2docs.parse_inline."""
+    text_style, fields = {}, []
+    if style.get('bold'):
+        text_style['bold'] = True
+        fields.append('bold')
+    if style.get('italic'):
+        text_style['italic'] = True
+        fields.append('italic')
+    if style.get('link'):
+        text_style['link'] = {'url': style['link']}
+        fields.append('link')
+    if style.get('code'):
+        text_style.update(CODE_STYLE)
+        fields.append('weightedFontFamily,backgroundColor')
+    return {
+        'updateTextStyle': {
+            'range': {'startIndex': start, 'endIndex': end},
+            'textStyle': text_style,
+            'fields': ','.join(fields),
+        }
+    }
+
+def _paragraph_style(start, end, named_style):
+    return {
+        'updateParagraphStyle': {
+            'range': {'startIndex': start, 'endIndex': end},
+            'paragraphStyle': {'namedStyleType': named_style},
+            'fields': 'namedStyleType',
+        }
+    }
+
+def build_requests(document_structure, start_index, max_insert_chars=DOCS_BATCH_MAX_CHARS):
+    """
+    Compiles a block structure into Docs API requests that insert it at `start_index`.
+
+    One pass over the blocks collects the text and the absolute (UTF-16) range
+    of every style. The text goes in as a few large inserts, then the styles
+    are applied. Bullets come last, in reverse order, because creating them
+    removes the leading tabs that set list nesting, which shifts everything
+    after them.
+
+    Returns:
+        tuple[list, int]: The requests, and the document's insertion index once they are applied.
+    """
+    pieces = []
+    styles = []
+    bullets = []
+    index = start_index
+
+    def add(text):
+        nonlocal index
+        pieces.append(text)
+        index += utf16_len(text)
+
+    def add_inline(text, base_style=None):
+        for run_text, run_style in parse_inline(text):
+            start = index
+            add(run_text)
+            if base_style:
+                run_style = {**base_style, **run_style}
+            if run_style:
+                styles.append(_text_style(start, index, run_style))
+
+    # Start on a new paragraph if there's content before
+    if start_index > 1:
+        add('\n\n')
+    content_start = index
+
+    last = len(document_structure) - 1
+    for position, block in enumerate(document_structure):
+        block_type = block.get("type")
+        start = index
+
+        if block_type == "heading":
+            add_inline(block.get("text", "No Heading"))
+            add('\n')
+            styles.append(_paragraph_style(start, index, f'HEADING_{block.get("level", 1)}'))
+            # Add an extra newline after heading for spacing if not the last block
+            if position < last:
+                add('\n')
+
+        elif block_type == "paragraph":
+            add_inline(block.get("text", ""))
+            add('\n')
+
+        elif block_type == "bold_note":
+            add('\n')
+            add_inline(block.get("text", ""), {'bold': True})
+            add('\n')
+
+        elif block_type == "list":
+            tabs = 0
+            for item in block.get("items", []):
+                if isinstance(item, str):
+                    item = {"text": item}
+                level = item.get("level", 0)
+                add('\t' * level)
+                tabs += level
+                add_inline(item.get("text", ""))
+                add('\n')
+            bullets.append((start, index, BULLET_PRESETS[bool(block.get("ordered"))], tabs))
+            add('\n')
+
+        elif block_type in ("code", "code_block"):
+            add(block.get("code", "").strip() + '\n')
+            styles.append(_text_style(start, index, {'code': True}))
+
+        elif block_type == "table":
+            for row_number, row in enumerate(block.get("rows", [])):
+                for cell_number, cell in enumerate(row):
+                    if cell_number:
+                        add(' | ')
+                    add_inline(cell, {'bold': True} if row_number == 0 else None)
+                add('\n')
+            add('\n')
+
+    requests = []
+    text = ''.join(pieces)
+    offset = start_index
+    for chunk_start in range(0, len(text), max_insert_chars):
+        chunk = text[chunk_start:chunk_start + max_insert_chars]
+        requests.append({'insertText': {'location': {'index': offset}, 'text': chunk}})
+        offset += utf16_len(chunk)
+
+    if index > content_start:
+        requests.append(_paragraph_style(content_start, index, 'NORMAL_TEXT'))
+        requests.append({
+            'updateTextStyle': {
+                'range': {'startIndex': content_start, 'endIndex': index},
+                'textStyle': {},
+                'fields': RESET_TEXT_FIELDS,
+            }
+        })
+    requests.extend(styles)
+    removed_tabs = 0
+    for start, end, preset, tabs in reversed(bullets):
+        requests.append({
+            'createParagraphBullets': {
+                'range': {'startIndex': start, 'endIndex': end},
+                'bulletPreset': preset,
+            }
+        })
+        removed_tabs += tabs
+    return requests, index - removed_tabs
+
+def _inserted_chars(request):
+    return len(request.get('insertText', {}).get('text', ''))
+
+def split_batches(requests, max_requests=DOCS_BATCH_MAX_REQUESTS, max_chars=DOCS_BATCH_MAX_CHARS):
+    """Splits a request list, in order, into batchUpdate-sized chunks."""
+    batch, batch_chars = [], 0
+    for request in requests:
+        chars = _inserted_chars(request)
+        if batch and (len(batch) >= max_requests or batch_chars + chars > max_chars):
+            yield batch
+            batch, batch_chars = [], 0
+        batch.append(request)
+        batch_chars += chars
+    if batch:
+        yield batch
+
+def requests_digest(requests) -> str:
+    """Fingerprint of a request list, to tell whether a partly written report is still the same report."""
+    return hashlib.sha256(json.dumps(requests, sort_keys=True).encode("utf-8")).hexdigest()
+
+def execute_with_retry(request, max_retries=DOCS_MAX_RETRIES):
+    """Executes an API request under the Docs rate limiter, retrying 429s and server errors with backoff."""
+    return rate_limit.call_with_retry(
+        "docs", request.execute, max_retries=max_retries, base_seconds=DOCS_RETRY_BASE_SECONDS
+    )
+
+class DocsSink:
+    """
+    Appends block structures to one Google Doc through a shared, authenticated client.
+
+    The document's end index is read once and then tracked locally, so each
+    append costs only its batchUpdate calls. Requests are sent in bounded
+    batches; if a write fails part-way the index is re-read before the next one.
+    """
+
+    def __init__(self, document_id=DOCUMENT_ID, service=None):
+        self.document_id = document_id
+        self._service = service
+        self._end_index = None
+        self._lock = threading.Lock()
+
+    @property
+    def service(self):
+        if self._service is None:
+            self._service = get_docs_service()
+            if self._service is None:
+                raise RuntimeError("Google Docs authentication failed")
+        return self._service
+
+    def _fetch_end_index(self):
+        doc = execute_with_retry(self.service.documents().get(documentId=self.document_id, fields='body.content'))
+        return insertion_index(doc.get('body', {}).get('content', []))
+
+    def append(self, document_structure, video_id=None) -> int:
+        """
+        Appends the blocks to the end of the document. Returns the number of requests sent.
+
+        With `video_id`, each batch that lands is recorded in the database. If
+        the append is cut short, the retry sends only the remaining batches, at
+        the indices of the first attempt, instead of appending the report again
+        after the partial copy.
+        """
+        from googleapiclient.errors import HttpError
+        if not document_structure:
+            return 0
+        repository = None
+        if video_id:
+            from videos_controller import get_repository
+            repository = get_repository()
+        with self._lock, (_append_guard(self.document_id) if _append_guard else contextlib.nullcontext()):
+            if _append_guard:
+                self._end_index = None  # other processes append too, so the tracked index can't be trusted
+            resume = repository.get_docs_append(video_id) if repository else None
+            if resume and resume["document_id"] != self.document_id:
+                resume = None
+            if resume:
+                requests, _ = build_requests(document_structure, resume["start_index"])
+                if requests_digest(requests) != resume["requests_digest"]:
+                    print(f"⚠️ Report of {video_id} changed since it was partly written, appending it in full")
+                    resume = None
+            for refreshed in (False, True):
+                if resume:
+                    start_index, skip = resume["start_index"], resume["batches_sent"]
+                else:
+                    if self._end_index is None:
+                        self._end_index = self._fetch_end_index()
+                    start_index, skip = self._end_index, 0
+                requests, end_index = build_requests(document_structure, start_index)
+                digest = requests_digest(requests) if repository else None
+                batches = list(split_batches(requests))
+                sent = skip
+                try:
+                    with metrics.timed("docs.append") as span:
+                        span["requests"] = len(requests)
+                        span["chars_in"] = sum(_inserted_chars(request) for request in requests)
+                        for batch in batches[skip:]:
+                            execute_with_retry(self.service.documents().batchUpdate(
+                                documentId=self.document_id, body={'requests': batch}
+                            ))
+                            sent += 1
+                            if repository:
+                                repository.save_docs_append(video_id, self.document_id, start_index, sent, digest)
+                        span["batches"] = sent - skip
+                except HttpError as err:
+                    self._end_index = None
+                    # A 400 on the first batch usually means someone else edited the document
+                    if sent == 0 and err.resp.status == 400 and not refreshed:
+                        print("⚠️ Document changed since the last write, re-reading its end index")
+                        continue
+                    raise
+                if resume:
+                    # Reports appended since the first attempt now follow this one
+                    self._end_index = None
+                    print(f"Document updated successfully: resumed after {skip} of {len(batches)} batches")
+                else:
+                    self._end_index = end_index
+                    print(f"Document updated successfully: {len(requests)} requests in {sent} batches")
+                return len(requests)
+
+_sinks = {}
+_append_guard = None
+
+def set_append_guard(guard):
+    """
+    Serialise appends across processes writing to the same documents.
+
+    `guard(document_id)` returns a context manager that is held around each
+    append; under it the end index is re-read instead of tracked locally.
+    """
+    global _append_guard
+    _append_guard = guard
+
+def get_docs_sink(document_id=DOCUMENT_ID) -> DocsSink:
+    """Process-wide sink per document, so repeated writes share the client and the tracked end index."""
+    with _service_lock:
+        if document_id not in _sinks:
+            _sinks[document_id] = DocsSink(document_id)
+        return _sinks[document_id]
+
 def write_content_to_doc(document_id, document_structure): # Renamed content_to_write to document_structure
     """Writes content based on a structured list to the Google Doc."""
-    service = authenticate_docs_api()
-    if not service:
-        return
-
+    from googleapiclient.errors import HttpError
     try:
-        current_doc_length = get_document_length(service, document_id)
-        print(f"Current document length: {current_doc_length}")
-        requests = []
-
-        # Start with a new line if it's not an empty document
-        if current_doc_length > 0:
-            requests.append({
-                'insertText': {
-                    'location': {'index': current_doc_length},
-                    'text': '\n\n'
-                }
-            })
-            current_doc_length += 2
-
-        for block in document_structure:
-            block_type = block.get("type")
-            text_to_insert = ""
-            block_start_index = current_doc_length # Store for potential inline formatting
-
-            if block_type == "heading":
-                level = block.get("level", 1)
-                heading_text = block.get("text", "No Heading")
-                text_to_insert = heading_text + "\n" # Add newline for spacing
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_doc_length},
-                        'text': text_to_insert
-                    }
-                })
-                requests.append({
-                    'updateParagraphStyle': {
-                        'range': {
-                            'startIndex': current_doc_length,
-                            'endIndex': current_doc_length + len(text_to_insert),
-                        },
-                        'paragraphStyle': {
-                            'namedStyleType': f'HEADING_{level}'
-                        },
-                        'fields': 'namedStyleType'
-                    }
-                })
-                current_doc_length += len(text_to_insert)
-                # Add an extra newline after heading for spacing if not the last block
-                if document_structure.index(block) < len(document_structure) - 1:
-                     requests.append({
-                        'insertText': {
-                            'location': {'index': current_doc_length},
-                            'text': '\n'
-                        }
-                    })
-                     current_doc_length += 1
-
-            elif block_type == "paragraph":
-                paragraph_text = block.get("text", "")
-                text_to_insert = paragraph_text + "\n"
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_doc_length},
-                        'text': text_to_insert
-                    }
-                })
-                # --- Here's where inline formatting logic would go ---
-                # Example: Simple bold detection (more sophisticated regex needed for actual MD)
-                # This is a very basic example; a full MD parser would be complex
-                bold_matches = re.finditer(r'\*\*(.*?)\*\*', paragraph_text)
-                for match in bold_matches:
-                    bold_start_rel = match.start()
-                    bold_end_rel = match.end()
-                    # Adjust for the '\n' at the end of text_to_insert if it's included in calculation
-                    # The actual text inserted is paragraph_text
-                    bold_doc_start = block_start_index + bold_start_rel
-                    bold_doc_end = block_start_index + bold_end_rel - 4 # Adjust for ** characters
-
-                    # Replace **text** with text before inserting to avoid literal **
-                    paragraph_text = paragraph_text.replace(match.group(0), match.group(1), 1)
-
-                    requests.append({
-                        'updateTextStyle': {
-                            'range': {
-                                'startIndex': bold_doc_start,
-                                'endIndex': bold_doc_end
-                            },
-                            'textStyle': {
-                                'bold': True
-                            },
-                            'fields': 'bold'
-                        }
-                    })
-                # If you modify text_to_insert (e.g., removing **), re-insert or recalculate length
-                # For simplicity here, assume you pre-process text_to_insert
-                # For actual inline MD, you'd insert plaintext and then apply formatting
-                # For a full MD parser, you'd insert segments of text with different styles
-
-                current_doc_length += len(text_to_insert)
-
-
-            elif block_type == "list":
-                list_items = block.get("items", [])
-                for item in list_items:
-                    list_item_text = f"• {item}\n" # For bullet points
-                    requests.append({
-                        'insertText': {
-                            'location': {'index': current_doc_length},
-                            'text': list_item_text
-                        }
-                    })
-                    requests.append({
-                        'createParagraphBullets': {
-                            'range': {
-                                'startIndex': current_doc_length,
-                                'endIndex': current_doc_length + len(list_item_text)
-                            },
-                            'bulletPreset': 'BULLET_DISC_CIRCLE_SQUARE'
-                        }
-                    })
-                    current_doc_length += len(list_item_text)
-                # Add an extra newline after list for spacing
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_doc_length},
-                        'text': '\n'
-                    }
-                })
-                current_doc_length += 1
-
-            elif block_type == "bold_note":
-                note_text = block.get("text", "")
-                text_to_insert = f'\n{note_text}\n'
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_doc_length},
-                        'text': text_to_insert
-                    }
-                })
-                requests.append({
-                    'updateTextStyle': {
-                        'range': {
-                            'startIndex': current_doc_length,
-                            'endIndex': current_doc_length + len(text_to_insert),
-                        },
-                        'textStyle': {
-                            'bold': True
-                        },
-                        'fields': 'bold'
-                    }
-                })
-                current_doc_length += len(text_to_insert)
-
-            elif block_type == "code_block":
-                code = block.get("code", "")
-                language = block.get("language", "")
-                code_text = f"{code.strip()}\n"
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_doc_length},
-                        'text': code_text
-                    }
-                })
-                requests.append({
-                    'updateTextStyle': {
-                        'range': {
-                            'startIndex': current_doc_length,
-                            'endIndex': current_doc_length + len(code_text),
-                        },
-                        'textStyle': {
-                            'weightedFontFamily': {'fontFamily': 'Courier New'},
-                            'backgroundColor': {
-                                'color': {'rgbColor': {'red': 0.95, 'green': 0.95, 'blue': 0.95}}
-                            }
-                        },
-                        'fields': 'weightedFontFamily,backgroundColor'
-                    }
-                })
-                current_doc_length += len(code_text)
-
-            # Add more elif blocks for other types (image, table, etc.)
-
-        result = service.documents().batchUpdate(
-            documentId=document_id, body={'requests': requests}
-        ).execute()
-        print(f"Document updated successfully. Replies: {len(result.get('replies'))}")
-
+        get_docs_sink(document_id).append(document_structure)
     except HttpError as err:
         print(f"An API error occurred: {err}")
     except Exception as e:
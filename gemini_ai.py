@@ -1,19 +1,31 @@
-import google.generativeai as genai
-from youtube_transcript_api import YouTubeTranscriptApi
-import os
-
-def youtube_transcripts(video_id: str, cache_file: str) -> str| None:
-    ytt_api = YouTubeTranscriptApi()
-    with open(f'{cache_file}', "a", encoding="utf-8") as f:
-        for chunk in ytt_api.fetch(video_id):
-            if chunk.text:
-                    f.write(chunk.text)  # Write each chunk to the cache file
-                    f.flush() # Ensure the file is written immediately
-        print(f"\n--- transcript produced succesfully  ---")
-    f.close()
-    return f.name 
-
-def generate_prompt_for_transcript()-> str:
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config import (
+    DOCS_REPORT_MODELS,
+    MAP_CONCURRENCY,
+    MAP_MODELS,
+    MAP_REDUCE_CHUNK_TOKENS,
+    MAP_REDUCE_THRESHOLD_TOKENS,
+    SUMMARY_MODELS,
+    TRANSCRIPT_PREPROCESS,
+)
+from buffered_io import BufferedStreamWriter
+from docs_sumamry_prompt import generate_ai_engineer_youtube_summary_prompt
+from llm_cache import find_cached_response, put_cached_response
+from model_fallback import AllModelsFailedError, stream_with_fallback
+from transcript_preprocess import preprocess_transcript
+from transcript_store import get_transcript, transcript_text
+
+def youtube_transcripts(video_id: str, languages=None) -> str:
+    """Returns the transcript text for a video, served from the transcript store when cached."""
+    transcript = get_transcript(video_id, languages)
+    print(f"\n--- transcript produced succesfully  ---")
+    return transcript_text(transcript)
+
+def generate_prompt_for_transcript(transcript: str)-> str:
+    """Builds the voice-note prompt for a transcript in memory."""
     prompt= f"""
             You are an AI researcher who generates high-quality voice-note summaries of technical or product YouTube videos for a busy audience of AI developers, ML engineers, startup founders, and VCs.
 
@@ -23,69 +35,203 @@ def generate_prompt_for_transcript()-> str:
 
             Do NOT use Markdown or code blocks. Do NOT include the transcript itself.
             """
-    with open('./curr_prompt_cache_file.txt', "w", encoding="utf-8") as f:
-        f.write(prompt)
-        f.flush() # Ensure the file is written immediately
-    f.close()
-    return f.name   
+    return prompt + transcript
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4
+
+def clean_transcript(transcript: dict) -> dict:
+    """Preprocesses a transcript record for prompting (see transcript_preprocess) and reports the token savings."""
+    if not TRANSCRIPT_PREPROCESS:
+        return transcript
+    with metrics.timed("transcript.preprocess") as span:
+        cleaned = preprocess_transcript(transcript)
+        before = span["tokens_in"] = estimate_tokens(transcript_text(transcript))
+        after = span["tokens_out"] = estimate_tokens(transcript_text(cleaned))
+    print(f"🧹 Transcript {transcript['video_id']} cleaned: ~{before} → ~{after} tokens "
+          f"(-{100 * (before - after) / max(1, before):.0f}%)")
+    return cleaned
+
+def generate_with_fallback_and_cache(
+    prompt: str,
+    models_to_try: list = None,
+    generation_config: dict = None,
+    use_cache: bool = True
+) -> tuple[str, str] | None:
+    """
+    Returns (model name, response text) for a prompt, served from the LLM cache when
+    any of the models already answered it, otherwise streamed with fallback.
+    Returns None if all models fail.
+    """
+    if models_to_try is None:
+        models_to_try = SUMMARY_MODELS
+
+    with metrics.timed("llm.request") as span:
+        span["prompt_tokens"] = estimate_tokens(prompt)
+        span["cache_hits"] = 0
+
+        # Any model in the list that already answered this exact prompt wins, in order of preference
+        if use_cache:
+            cached = find_cached_response(models_to_try, prompt, generation_config)
+            if cached is not None:
+                print(f"⚡ Cache hit for {cached[0]}.")
+                span["cache_hits"] = 1
+                span["response_tokens"] = estimate_tokens(cached[1])
+                return cached
+
+        started_at = time.monotonic()
+        try:
+            model_name, full_response_text = stream_with_fallback(prompt, models_to_try, generation_config)
+        except AllModelsFailedError:
+            print("🚫 All Gemini models failed to generate content.")
+            span["failures"] = 1
+            return None
+
+        span["response_tokens"] = estimate_tokens(full_response_text)
+        if use_cache:
+            put_cached_response(
+                model_name, prompt, full_response_text,
+                params=generation_config,
+                latency_seconds=time.monotonic() - started_at,
+            )
+        return model_name, full_response_text
 
 def gemini_streaming_with_fallback_and_cache(
-    prompt_path: str,
+    prompt_path: str = None,
     cache_file_path: str = "gemini_summary_cache.txt",
     models_to_try: list = None,
-    encoding: str = "utf-8"
+    encoding: str = "utf-8",
+    prompt: str = None,
+    generation_config: dict = None,
+    use_cache: bool = True
 ) -> str:
     """
-    Generates content using Gemini models with streaming, by reading a large prompt
-    from a file and trying models in order of preference. Output is printed and saved.
+    Generates content using Gemini models with streaming, from an in-memory prompt
+    (or one read from a file) and trying models in order of preference, each under its own
+    first-token and total deadline (see model_fallback). Output is printed and saved.
+    Responses are cached on disk by (model, prompt, generation_config), so a rerun
+    with the same prompt returns instantly without calling the API.
 
     Args:
-        prompt_path (str): Path to the file containing the full prompt (transcript + instruction).
+        prompt_path (str): Path to the file containing the full prompt, used when `prompt` is not given.
         cache_file_path (str): File where generated content is saved.
         models_to_try (list): Ordered list of Gemini model names to try.
         encoding (str): Encoding used when reading/writing files.
+        prompt (str): Full prompt text (transcript + instruction).
+        generation_config (dict): Optional Gemini generation parameters.
+        use_cache (bool): Read from and write to the LLM response cache.
 
     Returns:
         str: Full generated response text or empty string if all models fail.
     """
-    if models_to_try is None:
-        models_to_try = [ "gemini-2.5-pro","gemini-2.5-flash", "gemini-2.5-flash-lite"]
-
     # Load the prompt in a memory-safe way
-    try:
-        with open(prompt_path, "r", encoding=encoding) as f:
-            prompt = f.read()
-    except Exception as e:
-        print(f"❌ Failed to read prompt file {prompt_path}: {e}")
+    if prompt is None:
+        try:
+            with open(prompt_path, "r", encoding=encoding) as f:
+                prompt = f.read()
+        except Exception as e:
+            print(f"❌ Failed to read prompt file {prompt_path}: {e}")
+            return ""
+
+    result = generate_with_fallback_and_cache(prompt, models_to_try, generation_config, use_cache)
+    if result is None:
         return ""
+    model_name, full_response_text = result
+
+    with BufferedStreamWriter(cache_file_path, encoding=encoding) as f:
+        f.write(full_response_text)
+    print(f"\n✅ Response from {model_name} cached to: {cache_file_path}")
+    return full_response_text
+
+def chunk_transcript_segments(segments: list, max_tokens: int) -> list[list[dict]]:
+    """Split transcript segments into consecutive chunks of at most ~max_tokens, on segment boundaries."""
+    chunks, current, current_tokens = [], [], 0
+    for segment in segments:
+        segment_tokens = estimate_tokens(segment["text"]) + 1
+        if current and current_tokens + segment_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(segment)
+        current_tokens += segment_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def generate_prompt_for_transcript_chunk(chunk_text: str, part: int, total_parts: int) -> str:
+    """Builds the map-step prompt for one part of a long transcript."""
+    prompt= f"""
+            You are an AI researcher taking notes on part {part} of {total_parts} of a long technical or product YouTube video transcript.
 
-    full_response_text = ""
+            Write dense, factual notes covering every technical idea, product claim, architecture detail, number, name and example in this part, in the order they appear. Keep speaker intent but drop filler and small talk.
 
-    for model_name in models_to_try:
-        print(f"Attempting to use model: {model_name}...")
-        try:
-            model = genai.GenerativeModel(model_name)
-            response_stream = model.generate_content(prompt, stream=True)
+            Do NOT summarise the whole video and do NOT add an introduction or conclusion — these notes will be merged with notes from the other parts.
+            """
+    return prompt + chunk_text
+
+def generate_prompt_for_chunk_notes(chunk_notes: list[str]) -> str:
+    """Builds the reduce-step voice-note prompt from the notes of every part."""
+    notes = "\n\n".join(
+        f"--- Notes for part {i} of {len(chunk_notes)} ---\n{note}" for i, note in enumerate(chunk_notes, start=1)
+    )
+    return generate_prompt_for_transcript(
+        "The transcript was too long to include in full, so below are detailed notes taken from "
+        "each consecutive part of it. Treat them together as the transcript.\n\n" + notes
+    )
+
+def summarise_transcript(transcript: dict, cache_file_path: str) -> str:
+    """
+    Writes the voice-note summary for a transcript record to `cache_file_path`.
 
-            current_model_response = ""
-            print(f"--- Streaming response from {model_name} ---")
+    Short transcripts are sent to the summary models in one prompt. Transcripts
+    above MAP_REDUCE_THRESHOLD_TOKENS are split on segment boundaries into
+    MAP_REDUCE_CHUNK_TOKENS chunks, each summarised concurrently with the cheap
+    MAP_MODELS, and the notes are merged by one reduce pass with SUMMARY_MODELS.
+    Every chunk response goes through the LLM cache, so a failed reduce step
+    doesn't redo the map step on the next run.
 
-            with open(cache_file_path, "w", encoding=encoding) as f:
-                for chunk in response_stream:
-                    if chunk.text:
-                        # print(chunk.text, end="", flush=True)
-                        f.write(chunk.text)  # Write each chunk to the cache file
-                        f.flush() # Ensure the file is written immediately
-                        current_model_response += chunk.text
+    Returns:
+        str: The summary text, or empty string if generation failed.
+    """
+    transcript = clean_transcript(transcript)
+    text = transcript_text(transcript)
+    if estimate_tokens(text) <= MAP_REDUCE_THRESHOLD_TOKENS:
+        return gemini_streaming_with_fallback_and_cache(
+            prompt=generate_prompt_for_transcript(text),
+            cache_file_path=cache_file_path,
+        )
+
+    chunks = chunk_transcript_segments(transcript["segments"], MAP_REDUCE_CHUNK_TOKENS)
+    print(f"✂️ Long transcript (~{estimate_tokens(text)} tokens), summarising {len(chunks)} chunks with {MAP_MODELS[0]}")
+    prompts = [
+        generate_prompt_for_transcript_chunk(transcript_text({"segments": chunk}), i, len(chunks))
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+    with ThreadPoolExecutor(max_workers=MAP_CONCURRENCY) as pool:
+        results = list(pool.map(lambda p: generate_with_fallback_and_cache(p, MAP_MODELS), prompts))
+
+    failed = sum(result is None for result in results)
+    if failed:
+        print(f"🚫 {failed} of {len(chunks)} chunks failed to summarise, skipping the reduce step.")
+        return ""
 
-            full_response_text = current_model_response
-            print(f"\n✅ Streaming complete using {model_name}. Response cached to: {cache_file_path}")
-            return full_response_text
+    return gemini_streaming_with_fallback_and_cache(
+        prompt=generate_prompt_for_chunk_notes([note for _, note in results]),
+        cache_file_path=cache_file_path,
+    )
 
-        except Exception as e:
-            print(f"❌ Error with {model_name}: {e}")
-            print("Trying next model...")
+def generate_docs_report(transcript: dict, youtube_url: str) -> str:
+    """
+    Generates the engineer-oriented Markdown report for a video from its transcript record.
 
-    print("🚫 All Gemini models failed to generate content.")
-    return ""
- 
\ No newline at end of file
+    Returns:
+        str: The report Markdown, or empty string if generation failed.
+    """
+    transcript = clean_transcript(transcript)
+    prompt = (
+        generate_ai_engineer_youtube_summary_prompt(youtube_url)
+        + "\n\nYou cannot open the URL, so base the report on this transcript of the video:\n\n"
+        + transcript_text(transcript)
+    )
+    result = generate_with_fallback_and_cache(prompt, DOCS_REPORT_MODELS)
+    return result[1] if result else ""
@@ -0,0 +1,368 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+import threading
+import time
+from collections import namedtuple
+
+from config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS
+from videos_controller import DB_PATH
+
+# Every stage a video can go through, in pipeline order
+PIPELINE_STAGES = ("transcript", "summary", "tts", "docs")
+
+# A job becomes claimable once all of its dependencies are done
+STAGE_DEPENDENCIES = {
+    "transcript": (),
+    "summary": ("transcript",),
+    "tts": ("summary",),
+    "docs": ("transcript",),
+}
+
+
+def downstream_stages(stages) -> set:
+    """Stages that depend on any of `stages`, directly or through other stages."""
+    found = set()
+    frontier = set(stages)
+    while frontier:
+        frontier = {stage for stage, deps in STAGE_DEPENDENCIES.items() if frontier & set(deps)} - found
+        found |= frontier
+    return found
+
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+# A namedtuple rather than a dataclass: importing dataclasses costs the CLI ~10ms at startup
+Job = namedtuple("Job", "video_id stage attempts worker_id")
+
+
+class JobQueue:
+    """SQLite-backed queue of per-video, per-stage jobs.
+
+    Each (video_id, stage) row moves pending → running → done, or back to
+    pending with a backoff on failure until JOB_MAX_ATTEMPTS is reached, then
+    to failed. Claims happen inside BEGIN IMMEDIATE transactions, so any number
+    of worker threads or processes sharing the DB file can drain the queue
+    without double-processing. A running job whose lease expires (its worker
+    crashed) becomes claimable again, so a restart resumes where it stopped.
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        # Autocommit mode so transactions are only the explicit BEGIN IMMEDIATE ones
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.RLock()
+        self.create_schema()
+
+    def create_schema(self):
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    video_id TEXT,
+                    stage TEXT,
+                    state TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    next_retry_at REAL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL,
+                    updated_at REAL,
+                    PRIMARY KEY (video_id, stage)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (state, next_retry_at)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS stage_dependencies (
+                    stage TEXT,
+                    depends_on TEXT,
+                    PRIMARY KEY (stage, depends_on)
+                )
+            """)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO stage_dependencies (stage, depends_on) VALUES (?, ?)",
+                [(stage, dep) for stage, deps in STAGE_DEPENDENCIES.items() for dep in deps],
+            )
+            # One row per worker process (main.py worker), on any host sharing the DB
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    host TEXT,
+                    pid INTEGER,
+                    stages TEXT,
+                    state TEXT DEFAULT 'running',
+                    started_at REAL,
+                    last_heartbeat REAL,
+                    stats TEXT
+                )
+            """)
+            # Named leases for work only one process may do at a time (e.g. appending to a Google Doc)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS locks (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT,
+                    expires_at REAL
+                )
+            """)
+
+    def enqueue(self, video_ids, stages) -> int:
+        """Create pending jobs for each video and stage; existing jobs are left untouched."""
+        with self._lock:
+            now = time.time()
+            rows = [(video_id, stage, now, now) for video_id in video_ids for stage in stages]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany("""
+                    INSERT OR IGNORE INTO jobs (video_id, stage, created_at, updated_at) VALUES (?, ?, ?, ?)
+                """, rows)
+                added = self._conn.total_changes - before
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return added
+
+    def claim(self, worker_id: str, stages=None, lease_seconds: float = JOB_LEASE_SECONDS) -> Job | None:
+        """Atomically take the next runnable job, or None if nothing is runnable right now.
+
+        Later stages are preferred so videos already in flight finish first.
+        """
+        with self._lock:
+            stages = list(stages or PIPELINE_STAGES)
+            placeholders = ",".join("?" * len(stages))
+            rank = " ".join(f"WHEN '{stage}' THEN {i}" for i, stage in enumerate(PIPELINE_STAGES))
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(f"""
+                    SELECT j.video_id, j.stage, j.attempts FROM jobs j
+                    WHERE j.stage IN ({placeholders})
+                      AND ((j.state = 'pending' AND j.next_retry_at <= ?)
+                           OR (j.state = 'running' AND j.lease_expires_at < ?))
+                      AND NOT EXISTS (
+                          SELECT 1 FROM stage_dependencies sd
+                          JOIN jobs d ON d.video_id = j.video_id AND d.stage = sd.depends_on
+                          WHERE sd.stage = j.stage AND d.state != 'done'
+                      )
+                    ORDER BY CASE j.stage {rank} END DESC, j.created_at
+                    LIMIT 1
+                """, (*stages, now, now)).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                video_id, stage, attempts = row
+                self._conn.execute("""
+                    UPDATE jobs SET state = 'running', lease_owner = ?, lease_expires_at = ?,
+                        attempts = attempts + 1, updated_at = ?
+                    WHERE video_id = ? AND stage = ?
+                """, (worker_id, now + lease_seconds, now, video_id, stage))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return Job(video_id, stage, attempts + 1, worker_id)
+
+    def extend_lease(self, job: Job, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Heartbeat for a long-running job. Returns False if the lease was lost to another worker."""
+        with self._lock:
+            now = time.time()
+            cursor = self._conn.execute("""
+                UPDATE jobs SET lease_expires_at = ?, updated_at = ?
+                WHERE video_id = ? AND stage = ? AND state = 'running' AND lease_owner = ?
+            """, (now + lease_seconds, now, job.video_id, job.stage, job.worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, job: Job):
+        with self._lock:
+            self._conn.execute("""
+                UPDATE jobs SET state = 'done', lease_owner = NULL, lease_expires_at = NULL,
+                    last_error = NULL, updated_at = ?
+                WHERE video_id = ? AND stage = ? AND lease_owner = ?
+            """, (time.time(), job.video_id, job.stage, job.worker_id))
+
+    def fail(self, job: Job, error: str):
+        """Schedule a retry with exponential backoff, or mark the job failed after JOB_MAX_ATTEMPTS.
+
+        A job that fails for good takes the pending jobs of its video that
+        depend on it down with it, as they could never run.
+        """
+        with self._lock:
+            now = time.time()
+            if job.attempts >= JOB_MAX_ATTEMPTS:
+                state, next_retry_at = FAILED, now
+            else:
+                state, next_retry_at = PENDING, now + JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+            dependents = sorted(downstream_stages([job.stage])) if state == FAILED else []
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute("""
+                    UPDATE jobs SET state = ?, next_retry_at = ?, last_error = ?,
+                        lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                    WHERE video_id = ? AND stage = ? AND lease_owner = ?
+                """, (state, next_retry_at, str(error)[:1000], now, job.video_id, job.stage, job.worker_id))
+                if cursor.rowcount and dependents:
+                    placeholders = ",".join("?" * len(dependents))
+                    self._conn.execute(f"""
+                        UPDATE jobs SET state = 'failed', last_error = ?, updated_at = ?
+                        WHERE video_id = ? AND state = 'pending' AND stage IN ({placeholders})
+                    """, (f"{job.stage} failed", now, job.video_id, *dependents))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return state
+
+    def retry_failed(self, stages=None, video_ids=None) -> int:
+        """Move failed jobs back to pending with a fresh attempt budget. Returns how many were moved.
+
+        Retrying a stage also retries the failed stages that depend on it.
+        `video_ids` limits the retry to those videos.
+        """
+        with self._lock:
+            stages = set(stages or PIPELINE_STAGES)
+            stages = sorted(stages | downstream_stages(stages))
+            query = f"""
+                UPDATE jobs SET state = 'pending', attempts = 0, next_retry_at = 0, updated_at = ?
+                WHERE state = 'failed' AND stage IN ({",".join("?" * len(stages))})
+            """
+            params = [time.time(), *stages]
+            if video_ids:
+                query += f" AND video_id IN ({','.join('?' * len(video_ids))})"
+                params += list(video_ids)
+            return self._conn.execute(query, params).rowcount
+
+    def requeue(self, video_id: str, stages) -> int:
+        """Send a video's jobs for `stages` back to pending with a fresh attempt budget, whatever their state."""
+        with self._lock:
+            stages = list(stages)
+            cursor = self._conn.execute(f"""
+                UPDATE jobs SET state = 'pending', attempts = 0, next_retry_at = 0, last_error = NULL,
+                    lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE video_id = ? AND stage IN ({",".join("?" * len(stages))})
+            """, (time.time(), video_id, *stages))
+            return cursor.rowcount
+
+    def has_work(self, stages=None) -> bool:
+        """True while a job in `stages` is claimable now, or any job is running (it may unlock one)."""
+        with self._lock:
+            stages = list(stages or PIPELINE_STAGES)
+            placeholders = ",".join("?" * len(stages))
+            return self._conn.execute(f"""
+                SELECT EXISTS (SELECT 1 FROM jobs WHERE state = 'running')
+                    OR EXISTS (
+                        SELECT 1 FROM jobs j
+                        WHERE j.stage IN ({placeholders}) AND j.state = 'pending' AND j.next_retry_at <= ?
+                          AND NOT EXISTS (
+                              SELECT 1 FROM stage_dependencies sd
+                              JOIN jobs d ON d.video_id = j.video_id AND d.stage = sd.depends_on
+                              WHERE sd.stage = j.stage AND d.state != 'done'
+                          )
+                    )
+            """, (*stages, time.time())).fetchone()[0] == 1
+
+    def register_worker(self, worker_id: str, host: str, pid: int, stages):
+        with self._lock:
+            now = time.time()
+            self._conn.execute("""
+                INSERT OR REPLACE INTO workers (worker_id, host, pid, stages, state, started_at, last_heartbeat, stats)
+                VALUES (?, ?, ?, ?, 'running', ?, ?, '{}')
+            """, (worker_id, host, pid, ",".join(stages), now, now))
+
+    def heartbeat(self, worker_id: str, stats: dict, state: str = "running"):
+        """Record that a worker process is alive, with its run counters."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE workers SET last_heartbeat = ?, stats = ?, state = ? WHERE worker_id = ?",
+                (time.time(), json.dumps(stats), state, worker_id),
+            )
+
+    def workers(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT worker_id, host, pid, stages, state, started_at, last_heartbeat, stats
+                FROM workers ORDER BY started_at
+            """).fetchall()
+            return [
+                {"worker_id": worker_id, "host": host, "pid": pid, "stages": stages.split(","), "state": state,
+                 "started_at": started_at, "last_heartbeat": last_heartbeat, "stats": json.loads(stats or "{}")}
+                for worker_id, host, pid, stages, state, started_at, last_heartbeat, stats in rows
+            ]
+
+    def remove_workers(self, worker_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM workers WHERE worker_id = ?", [(w,) for w in worker_ids])
+
+    def reclaim_jobs(self, worker_id: str) -> int:
+        """Hand a dead worker process's running jobs and locks back without waiting for their leases to expire."""
+        with self._lock:
+            now = time.time()
+            cursor = self._conn.execute("""
+                UPDATE jobs SET state = 'pending', lease_owner = NULL, lease_expires_at = NULL,
+                    next_retry_at = ?, updated_at = ?
+                WHERE state = 'running' AND substr(lease_owner, 1, ?) = ?
+            """, (now, now, len(worker_id) + 1, worker_id + ":"))
+            self._conn.execute("DELETE FROM locks WHERE owner = ?", (worker_id,))
+            return cursor.rowcount
+
+    def reclaim_stale_workers(self, stale_seconds: float) -> dict:
+        """Mark workers silent for `stale_seconds` as lost and reclaim their jobs. Returns {worker_id: jobs}."""
+        with self._lock:
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT worker_id FROM workers WHERE state = 'running' AND last_heartbeat < ?",
+                (time.time() - stale_seconds,),
+            )]
+            reclaimed = {}
+            for worker_id in stale:
+                self._conn.execute("UPDATE workers SET state = 'lost' WHERE worker_id = ?", (worker_id,))
+                reclaimed[worker_id] = self.reclaim_jobs(worker_id)
+            return reclaimed
+
+    def try_lock(self, name: str, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Take the named lock if it's free, expired or already ours."""
+        with self._lock:
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT owner, expires_at FROM locks WHERE name = ?", (name,)).fetchone()
+                acquired = row is None or row[0] == owner or row[1] < now
+                if acquired:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                        (name, owner, now + lease_seconds),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return acquired
+
+    def unlock(self, name: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    @contextmanager
+    def locked(self, name: str, owner: str, lease_seconds: float = JOB_LEASE_SECONDS, poll_seconds: float = 0.2):
+        """Hold the named lock for the block, waiting for it if another process has it."""
+        while not self.try_lock(name, owner, lease_seconds):
+            time.sleep(poll_seconds)
+        try:
+            yield
+        finally:
+            self.unlock(name, owner)
+
+    def counts(self) -> dict:
+        """Number of jobs per (stage, state)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, state, COUNT(*) FROM jobs GROUP BY stage, state").fetchall()
+            return {(stage, state): count for stage, state, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from config import LLM_CACHE_DB_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL_HOURS
+
+# Counters for this process, see get_cache_stats()
+_stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0, "saved_chars": 0}
+_stats_lock = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(LLM_CACHE_DB_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            size INTEGER,
+            latency_seconds REAL,
+            created_at REAL,
+            last_accessed_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_lru ON llm_cache (last_accessed_at)")
+    return conn
+
+
+def make_cache_key(model: str, prompt: str, params: dict = None) -> str:
+    """Hash of (model, prompt text, generation params) used as the cache key."""
+    payload = json.dumps(
+        {"model": model, "prompt": prompt, "params": params or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(model: str, prompt: str, params: dict = None) -> str | None:
+    """Return a cached response for this exact request, or None on a miss or expired entry."""
+    found = find_cached_response([model], prompt, params)
+    return found[1] if found else None
+
+
+def find_cached_response(models: list, prompt: str, params: dict = None) -> tuple[str, str] | None:
+    """
+    Return (model, response) for the first model, in order, that has this prompt cached.
+    Counts as a single hit or miss however many models are checked.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        for model in models:
+            key = make_cache_key(model, prompt, params)
+            row = conn.execute(
+                "SELECT response, latency_seconds, created_at FROM llm_cache WHERE cache_key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                continue
+            if LLM_CACHE_TTL_HOURS and now - row[2] > LLM_CACHE_TTL_HOURS * 3600:
+                conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                conn.commit()
+                continue
+            conn.execute("UPDATE llm_cache SET last_accessed_at = ? WHERE cache_key = ?", (now, key))
+            conn.commit()
+            response, latency, _ = row
+            with _stats_lock:
+                _stats["hits"] += 1
+                _stats["saved_seconds"] += latency or 0.0
+                _stats["saved_chars"] += len(response)
+            return model, response
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        _stats["misses"] += 1
+    return None
+
+
+def put_cached_response(model: str, prompt: str, response: str, params: dict = None, latency_seconds: float = 0.0):
+    """Store a response and evict expired / least recently used entries over the size limit."""
+    key = make_cache_key(model, prompt, params)
+    now = time.time()
+    size = len(response.encode("utf-8"))
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO llm_cache
+                (cache_key, model, response, size, latency_seconds, created_at, last_accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (key, model, response, size, latency_seconds, now, now),
+        )
+        _evict(conn, now)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _evict(conn, now):
+    if LLM_CACHE_TTL_HOURS:
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL_HOURS * 3600,))
+    if not LLM_CACHE_MAX_BYTES:
+        return
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+    if total <= LLM_CACHE_MAX_BYTES:
+        return
+    # Drop least recently used entries until we're back under the limit
+    rows = conn.execute("SELECT cache_key, size FROM llm_cache ORDER BY last_accessed_at ASC").fetchall()
+    to_delete = []
+    for cache_key, size in rows:
+        if total <= LLM_CACHE_MAX_BYTES:
+            break
+        to_delete.append((cache_key,))
+        total -= size
+    conn.executemany("DELETE FROM llm_cache WHERE cache_key = ?", to_delete)
+
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters for this process plus the current on-disk footprint."""
+    with _stats_lock:
+        stats = dict(_stats)
+    conn = _connect()
+    try:
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+    finally:
+        conn.close()
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = entries
+    stats["size_bytes"] = size
+    return stats
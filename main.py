@@ -1,76 +1,263 @@
-from config import CACHE_FOLDER, GEMINI_API_KEY, VOICE_NOTES_FOLDER
-import google.generativeai as genai
-import re
-import asyncio
+import argparse
+import sys
+import time
 from datetime import datetime
-from videos_controller import fetch_new_youtube_videos, get_videos_without_voice_notes, update_voice_note_status
-from gemini_ai import (
-    gemini_streaming_with_fallback_and_cache,
-    generate_prompt_for_transcript,
-    youtube_transcripts,
-)
-from tts import convert_text_to_voice_notes
+
+from config import GEMINI_API_KEY, VOICE_NOTES_FOLDER
+
+# Heavy SDKs (google-generativeai, googleapiclient, edge-tts, ...) are imported
+# inside the commands that need them, so `status` and `--help` start instantly.
 
 # === Configuration ===
-source_folder = CACHE_FOLDER
 destination_folder = VOICE_NOTES_FOLDER
 
-log_data = {
-    "start_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-    "retrieved_videos": 0,
-    "videos_without_voice_notes": 0,
-    "converted_videos": 0,
-    "failed_conversions": 0,
-    "end_time": None
-}
-
-try: 
-        
-    log_data["retrieved_videos"],log_data["videos_without_voice_notes"] =fetch_new_youtube_videos()
+
+def configure_gemini():
+    import google.generativeai as genai
     genai.configure(api_key=GEMINI_API_KEY)
-    # print("✅ Gemini API configured.")
-except KeyError:
-    print("❌ GEMINI_API_KEY not set. Define it in your config.py.")
-    exit()
-
-# === Generate Prompts and Summaries ===
-try:
-    videos = get_videos_without_voice_notes()
-    for video_id, title in videos:
-        print(f"\n🎬 Starting voice-note prompt generation for video: {title}")
-
-        # Step 1: Prepare prompt file
-        prompt_file = generate_prompt_for_transcript()
-        prompt_file = youtube_transcripts(video_id=video_id, cache_file=prompt_file)
-
-        # Step 2: Prepare cache filename for output summary
-        raw_title = title.split("—")[0].strip()
-        safe_title = re.sub(r"[^\w\-_.]", "_", raw_title)
-        summary_file_path = f"{source_folder}/{video_id}__{safe_title}_voice_note.txt"
-        # Step 3: Generate summary
-        gemini_streaming_with_fallback_and_cache(
-            prompt_path=prompt_file,
-            cache_file_path=summary_file_path
-        )
-        print(f"✅ Summary generated and saved to {summary_file_path}")
-        update_voice_note_status(video_id)
-
-except Exception as e:
-    print(f"❌ Error during video processing: {e}")
-    exit()
-
-# === Convert Summaries to Voice Notes ===
-try:
-    asyncio.run(convert_text_to_voice_notes(source_folder, destination_folder))
-    print(f"✅ Voice notes saved to {destination_folder}")
-except Exception as e:
-    log_data["failed_conversions"] += 1
-    print(f"❌ TTS conversion failed: {e}")
-log_data["end_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-# Write analytics to logs.csv
-with open('logs.csv', 'a') as log_file:
-    log_file.write(
-        f'{log_data["start_time"]},{log_data["end_time"]},{log_data["retrieved_videos"]},{log_data["videos_without_voice_notes"]},{log_data["converted_videos"]},{log_data["failed_conversions"]}\n'
+
+
+def print_cache_stats():
+    from llm_cache import get_cache_stats
+    cache_stats = get_cache_stats()
+    print(
+        f"💾 LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+        f"saved ~{cache_stats['saved_seconds']:.0f}s of generation "
+        f"({cache_stats['entries']} entries, {cache_stats['size_bytes'] / 1e6:.1f} MB)"
     )
-    exit()
+
+
+def drain_queue(stages=None) -> bool:
+    """Queue pending videos and run the pipeline until nothing is runnable. Returns False if there was nothing to do."""
+    import asyncio
+    from job_queue import JobQueue
+    from pipeline import enqueue_pending_videos, run_pipeline
+
+    job_queue = JobQueue()
+    enqueue_pending_videos(job_queue)
+    # Pending jobs behind a failed or backing-off dependency don't count, only claimable ones
+    if not job_queue.has_work(stages):
+        print("✅ Nothing to do: no pending jobs.")
+        return False
+    configure_gemini()
+    asyncio.run(run_pipeline(job_queue, stages=stages))
+    return True
+
+
+def run_once(force=False):
+    """One-shot run: sync channels, drain the job queue and record a run summary in the metrics log."""
+    import metrics
+    from llm_cache import get_cache_stats
+    from videos_controller import fetch_new_youtube_videos
+    from pipeline import run_stats
+
+    run = {
+        "start_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "retrieved_videos": 0,
+        "new_videos": 0,
+        "ok": False,
+    }
+    started_at = time.perf_counter()
+    # The summary is recorded even when the run dies part-way
+    try:
+        run["retrieved_videos"], run["new_videos"] = fetch_new_youtube_videos(force=force)
+
+        # === Generate Summaries and Voice Notes ===
+        if drain_queue():
+            print(f"✅ Voice notes saved to {destination_folder}")
+        print_cache_stats()
+        run["ok"] = True
+    except Exception as e:
+        print(f"❌ Error during video processing: {e}")
+        sys.exit(1)
+    finally:
+        cache_stats = get_cache_stats()
+        metrics.record(
+            "run",
+            **run,
+            **run_stats,
+            end_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            seconds=round(time.perf_counter() - started_at, 2),
+            llm_cache_hits=cache_stats["hits"],
+            llm_cache_misses=cache_stats["misses"],
+        )
+
+
+def cmd_run(args):
+    run_once(force=args.force)
+
+
+def cmd_sync(args):
+    from videos_controller import fetch_new_youtube_videos
+    fetch_new_youtube_videos(force=args.force)
+
+
+def cmd_summarise(args):
+    drain_queue(stages=("transcript", "summary"))
+    print_cache_stats()
+
+
+def cmd_tts(args):
+    drain_queue(stages=("tts",))
+
+
+def cmd_docs(args):
+    from config import DOCUMENT_ID
+    from docs_updater import write_content_to_doc
+    from md2docs import markdown_to_document_structure
+
+    with open(args.markdown_file, "r", encoding="utf-8") as f:
+        document_structure = markdown_to_document_structure(f.read())
+    write_content_to_doc(args.document_id or DOCUMENT_ID, document_structure)
+
+
+def cmd_status(args):
+    """Queue and database overview; touches only SQLite so it runs without loading any API client."""
+    from job_queue import JobQueue
+    from llm_cache import get_cache_stats
+    from videos_controller import get_repository, subscribed_channel_ids
+
+    repository = get_repository()
+    # Counts channels as configured now, not as of the last sync
+    repository.subscribe_channels(subscribed_channel_ids())
+    with repository.transaction() as conn:
+        total, voiced, duplicates = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(voice_note_generated), 0), COUNT(duplicate_of) FROM videos"
+        ).fetchone()
+        indexed = conn.execute("SELECT COUNT(*) FROM transcript_signatures").fetchone()[0]
+    print(f"🎬 Videos: {total} ({voiced} with voice notes, {total - voiced} pending)")
+    print(f"🧬 Dedup index: {indexed} transcripts, {duplicates} near-duplicates reusing a voice note")
+
+    job_queue = JobQueue()
+    jobs = {}
+    for (stage, state), count in job_queue.counts().items():
+        jobs.setdefault(stage, {})[state] = count
+    for stage, states in jobs.items():
+        print(f"🧱 {stage}: " + ", ".join(f"{count} {state}" for state, count in sorted(states.items())))
+
+    for worker in job_queue.workers():
+        stats = worker["stats"]
+        print(f"👷 Worker {worker['worker_id']} ({worker['state']}, {', '.join(worker['stages'])}): "
+              f"last heartbeat {time.time() - worker['last_heartbeat']:.0f}s ago, "
+              f"{stats.get('converted_videos', 0)} voice notes, {stats.get('failed_conversions', 0)} failed")
+
+    print(f"📡 Channels: {len(repository.get_channels())} subscribed, {len(repository.get_due_channels())} due for polling")
+    print(f"📊 YouTube quota used today: {repository.quota_used_today()} units")
+    cache_stats = get_cache_stats()
+    print(f"💾 LLM cache: {cache_stats['entries']} entries, {cache_stats['size_bytes'] / 1e6:.1f} MB")
+
+
+def cmd_report(args):
+    """Latency percentiles and counters from the metrics log."""
+    import metrics
+    path = args.path or metrics.METRICS_PATH
+    events = metrics.load_events(path)
+    if args.last_run:
+        run_starts = [i for i, event in enumerate(events) if event.get("event") == "run"]
+        events = events[run_starts[-2] + 1:] if len(run_starts) > 1 else events
+    if not events:
+        print(f"No metrics recorded in {path} yet.")
+        return
+    print(metrics.format_prometheus(events) if args.prometheus else metrics.format_report(events))
+
+
+def cmd_worker(args):
+    from job_queue import PIPELINE_STAGES
+    from workers import run_worker
+
+    stages = args.stages.split(",") if args.stages else None
+    unknown = set(stages or ()) - set(PIPELINE_STAGES)
+    if unknown:
+        sys.exit(f"unknown stage: {', '.join(sorted(unknown))} (choose from {', '.join(PIPELINE_STAGES)})")
+    run_worker(stages, follow=args.follow, rate_share=args.rate_share)
+
+
+def cmd_workers(args):
+    from workers import run_coordinator
+    run_coordinator(processes=args.processes, sync=not args.no_sync, force=args.force)
+
+
+def cmd_dedup(args):
+    from dedup import index_existing
+    index_existing(rebuild=args.rebuild)
+
+
+def cmd_retry(args):
+    from job_queue import JobQueue, PIPELINE_STAGES
+
+    stages = args.stages.split(",") if args.stages else None
+    unknown = set(stages or ()) - set(PIPELINE_STAGES)
+    if unknown:
+        sys.exit(f"unknown stage: {', '.join(sorted(unknown))} (choose from {', '.join(PIPELINE_STAGES)})")
+    retried = JobQueue().retry_failed(stages, args.video_ids)
+    print(f"🔁 {retried} failed jobs queued again, `python main.py run` processes them")
+
+
+def cmd_serve(args):
+    from daemon import serve
+    serve()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Summarise new YouTube videos into voice notes.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="sync channels and process every pending video (default)")
+    run_parser.add_argument("--force", action="store_true", help="poll all channels regardless of schedule")
+    run_parser.set_defaults(func=cmd_run)
+
+    sync_parser = subparsers.add_parser("sync", help="only fetch new videos from subscribed channels")
+    sync_parser.add_argument("--force", action="store_true", help="poll all channels regardless of schedule")
+    sync_parser.set_defaults(func=cmd_sync)
+
+    subparsers.add_parser("summarise", help="only fetch transcripts and write summaries").set_defaults(func=cmd_summarise)
+    subparsers.add_parser("tts", help="only convert finished summaries to voice notes").set_defaults(func=cmd_tts)
+
+    docs_parser = subparsers.add_parser("docs", help="append a Markdown file to the Google Doc")
+    docs_parser.add_argument("markdown_file")
+    docs_parser.add_argument("--document-id", help="defaults to DOCUMENT_ID from config")
+    docs_parser.set_defaults(func=cmd_docs)
+
+    subparsers.add_parser("status", help="show queue, quota and cache state").set_defaults(func=cmd_status)
+    report_parser = subparsers.add_parser("report", help="p50/p95 latency per stage and counters from the metrics log")
+    report_parser.add_argument("--path", default=None, help="metrics file, defaults to METRICS_PATH from config")
+    report_parser.add_argument("--last-run", action="store_true", help="only events since the previous run ended")
+    report_parser.add_argument("--prometheus", action="store_true", help="print in Prometheus text format")
+    report_parser.set_defaults(func=cmd_report)
+
+    retry_parser = subparsers.add_parser("retry", help="queue failed jobs again with a fresh attempt budget")
+    retry_parser.add_argument("video_ids", nargs="*", help="only these videos (default: all)")
+    retry_parser.add_argument("--stages", help="comma-separated stages to retry, with the stages after them (default: all)")
+    retry_parser.set_defaults(func=cmd_retry)
+
+    dedup_parser = subparsers.add_parser("dedup", help="add already voiced videos to the near-duplicate index")
+    dedup_parser.add_argument("--rebuild", action="store_true", help="empty the index first (after changing DEDUP_* settings)")
+    dedup_parser.set_defaults(func=cmd_dedup)
+
+    subparsers.add_parser("serve", help="run continuously with a health endpoint").set_defaults(func=cmd_serve)
+
+    workers_parser = subparsers.add_parser("workers", help="sync, then process the backlog with several worker processes")
+    workers_parser.add_argument("-n", "--processes", type=int, default=None, help="defaults to WORKER_PROCESSES from config")
+    workers_parser.add_argument("--no-sync", action="store_true", help="only process videos already in the database")
+    workers_parser.add_argument("--force", action="store_true", help="poll all channels regardless of schedule")
+    workers_parser.set_defaults(func=cmd_workers)
+
+    worker_parser = subparsers.add_parser("worker", help="run one worker process against the shared job queue")
+    worker_parser.add_argument("--stages", help="comma-separated stages to work on (default: all)")
+    worker_parser.add_argument("--follow", action="store_true", help="keep polling for new jobs until interrupted")
+    worker_parser.add_argument("--rate-share", type=float, default=1.0,
+                               help="fraction of the configured API rate limits for this process")
+    worker_parser.set_defaults(func=cmd_worker)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(["run"])
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,271 @@
-import markdown
-from bs4 import BeautifulSoup
+import re
+
+FENCE_RE = re.compile(r"^\s*(`{3,}|~{3,})\s*([^\s`]*)")
+HEADING_RE = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)(?:\s+#+)?\s*$")
+SETEXT_RE = re.compile(r"^\s{0,3}(=+|-+)\s*$")
+RULE_RE = re.compile(r"^\s{0,3}([-*_])(?:\s*\1){2,}\s*$")
+LIST_ITEM_RE = re.compile(r"^(\s*)([-*+]|\d{1,9}[.)])\s+(.*)$")
+QUOTE_RE = re.compile(r"^\s{0,3}>\s?(.*)$")
+TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+
+
+def split_table_row(line):
+    cells = line.strip()
+    if cells.startswith("|"):
+        cells = cells[1:]
+    if cells.endswith("|") and not cells.endswith("\\|"):
+        cells = cells[:-1]
+    return [cell.strip() for cell in re.split(r"(?<!\\)\|", cells)]
+
+
+class MarkdownStream:
+    """
+    Incremental Markdown to block-structure converter.
+
+    Feed text as it arrives (e.g. chunks of a Gemini stream); each call
+    returns the blocks completed so far, and close() returns the rest. Lines
+    are tokenized directly into headings, paragraphs, nested lists, tables
+    and fenced code, with no HTML stage. Block text keeps its inline Markdown
+    (bold, italic, code, links), see parse_inline().
+    """
+
+    def __init__(self):
+        self._partial = []   # text of the current, unfinished line
+        self._done = []      # blocks completed since the last feed()/close()
+        self._kind = None    # open block: paragraph, list, table or code
+        self._lines = []     # paragraph lines / table rows / code lines
+        self._items = []     # list items ({text, level})
+        self._indents = []   # indentation of each open list level
+        self._ordered = False
+        self._blank = False  # last line was blank
+        self._fence = None
+        self._language = ""
+
+    def feed(self, text):
+        """Consume a chunk of Markdown and return the blocks it completed."""
+        if "\n" not in text:
+            self._partial.append(text)
+            return self._take()
+        self._partial.append(text)
+        lines = "".join(self._partial).split("\n")
+        self._partial = [lines.pop()]
+        for line in lines:
+            self._line(line.rstrip("\r"))
+        return self._take()
+
+    def close(self):
+        """Flush the last line and any open block."""
+        tail = "".join(self._partial)
+        self._partial = []
+        if tail:
+            self._line(tail)
+        self._flush()
+        return self._take()
+
+    def _take(self):
+        done, self._done = self._done, []
+        return done
+
+    def _flush(self):
+        kind = self._kind
+        if kind == "paragraph":
+            self._done.append({"type": "paragraph", "text": " ".join(self._lines)})
+        elif kind == "list":
+            self._done.append({"type": "list", "ordered": self._ordered, "items": self._items})
+        elif kind == "table":
+            self._done.append({"type": "table", "rows": self._lines})
+        elif kind == "code":
+            self._done.append({"type": "code", "language": self._language, "code": "\n".join(self._lines)})
+        self._kind, self._lines, self._items, self._indents = None, [], [], []
+
+    def _line(self, line):
+        if self._kind == "code":
+            stripped = line.strip()
+            if stripped.startswith(self._fence) and not stripped.strip(self._fence[0]):
+                self._flush()
+            else:
+                self._lines.append(line)
+            return
+
+        blank, self._blank = self._blank, not line.strip()
+        if not line.strip():
+            if self._kind in ("paragraph", "table"):
+                self._flush()
+            return
+
+        fence = FENCE_RE.match(line)
+        if fence:
+            self._flush()
+            self._kind, self._fence, self._language = "code", fence.group(1), fence.group(2)
+            return
+
+        heading = HEADING_RE.match(line)
+        if heading:
+            self._flush()
+            self._done.append({"type": "heading", "level": len(heading.group(1)), "text": heading.group(2)})
+            return
+
+        if self._kind == "paragraph":
+            setext = SETEXT_RE.match(line)
+            if setext:
+                text = " ".join(self._lines)
+                self._kind, self._lines = None, []
+                self._done.append({"type": "heading", "level": 1 if setext.group(1)[0] == "=" else 2, "text": text})
+                return
+            if len(self._lines) == 1 and "|" in self._lines[0] and TABLE_SEPARATOR_RE.match(line):
+                self._kind, self._lines = "table", [split_table_row(self._lines[0])]
+                return
+
+        if RULE_RE.match(line):
+            self._flush()
+            return
+
+        item = LIST_ITEM_RE.match(line)
+        if item:
+            self._list_item(item)
+            return
+
+        if self._kind == "list":
+            indented = line[:1].isspace()
+            if indented or not blank:
+                # Continuation of the last item
+                self._items[-1]["text"] += " " + line.strip()
+                return
+            self._flush()
+
+        if self._kind == "table":
+            if "|" in line:
+                self._lines.append(split_table_row(line))
+                return
+            self._flush()
+
+        quote = QUOTE_RE.match(line)
+        text = (quote.group(1) if quote else line).strip()
+        if self._kind != "paragraph":
+            self._flush()
+            self._kind = "paragraph"
+        if text:
+            self._lines.append(text)
+
+    def _list_item(self, item):
+        indent = len(item.group(1).expandtabs(4))
+        ordered = item.group(2)[0].isdigit()
+        if self._kind != "list" or (not self._indents or indent <= self._indents[0]) and ordered != self._ordered:
+            self._flush()
+            self._kind, self._ordered = "list", ordered
+        while self._indents and indent < self._indents[-1]:
+            self._indents.pop()
+        if not self._indents or indent > self._indents[-1]:
+            self._indents.append(indent)
+        self._items.append({"text": item.group(3).strip(), "level": len(self._indents) - 1})
+
 
 def markdown_to_document_structure(mdstring):
-    html = markdown.markdown(mdstring, extensions=['fenced_code', 'tables'])
-    soup = BeautifulSoup(html, "html.parser")
-    
-    doc_structure = []
-    for element in soup.recursiveChildGenerator():
-        if element.name:
-            if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                doc_structure.append({
-                    "type": "heading",
-                    "level": int(element.name[1]),
-                    "text": element.get_text(strip=True)
-                })
-            elif element.name == "p":
-                doc_structure.append({
-                    "type": "paragraph",
-                    "text": element.get_text(strip=True)
-                })
-            elif element.name == "ul":
-                items = [li.get_text(strip=True) for li in element.find_all("li")]
-                doc_structure.append({
-                    "type": "list",
-                    "items": items
-                })
-            elif element.name == "pre":
-                code = element.get_text()
-                lang = element.code.get("class", [""])[0].replace("language-", "") if element.code else ""
-                doc_structure.append({
-                    "type": "code",
-                    "language": lang,
-                    "code": code.strip()
-                })
-    return doc_structure
+    """Converts a complete Markdown string into the block structure used by docs_updater."""
+    stream = MarkdownStream()
+    return stream.feed(mdstring) + stream.close()
+
+
+# Characters a backslash can escape in inline Markdown
+ESCAPABLE = set("\\`*_{}[]()#+-.!|>~")
+
+def parse_inline(text):
+    """
+    Splits inline Markdown into styled runs in a single left-to-right scan.
+
+    Supports **bold**/__bold__, *italic*/_italic_, `code` and [links](url);
+    unclosed markers are kept as literal text and intraword underscores
+    (snake_case) are left alone.
+
+    Returns:
+        list[tuple[str, dict]]: (text, style) runs, where style holds any of
+        `bold`, `italic`, `code` (True) and `link` (the url).
+    """
+    runs = []                                  # [text, style] pairs; None style = pending marker
+    buf = []
+    openers = {"bold": None, "italic": None}   # kind -> (run index, marker, style before it)
+    next_pos = {}                              # cached lookahead keeps the scan linear
+
+    def find(ch, start):
+        pos = next_pos.get(ch)
+        if pos is None or start > pos >= 0:
+            pos = text.find(ch, start)
+            next_pos[ch] = pos
+        return pos
+
+    def style():
+        return {kind: True for kind, opener in openers.items() if opener is not None}
+
+    def flush():
+        if buf:
+            runs.append(["".join(buf), style()])
+            buf.clear()
+
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n and text[i + 1] in ESCAPABLE:
+            buf.append(text[i + 1])
+            i += 2
+            continue
+        if ch == "`":
+            end = find("`", i + 1)
+            if end != -1:
+                flush()
+                runs.append([text[i + 1:end], {**style(), "code": True}])
+                i = end + 1
+                continue
+        elif ch == "[":
+            close = find("]", i + 1)
+            if close != -1 and text.startswith("(", close + 1):
+                end = find(")", close + 2)
+                if end != -1:
+                    flush()
+                    url = text[close + 2:end].strip()
+                    for label, label_style in parse_inline(text[i + 1:close]):
+                        runs.append([label, {**style(), **label_style, "link": url}])
+                    i = end + 1
+                    continue
+        elif ch in "*_":
+            marker = ch * 2 if text.startswith(ch * 2, i) else ch
+            kind = "bold" if len(marker) == 2 else "italic"
+            before = text[i - 1] if i else " "
+            after = text[i + len(marker)] if i + len(marker) < n else " "
+            opener = openers[kind]
+            if ch == "_" and before.isalnum() and after.isalnum():
+                pass  # snake_case, not emphasis
+            elif opener is not None and opener[1] == marker and not before.isspace():
+                flush()
+                runs[opener[0]][0] = ""
+                openers[kind] = None
+                i += len(marker)
+                continue
+            elif opener is None and not after.isspace():
+                flush()
+                openers[kind] = (len(runs), marker, style())
+                runs.append([marker, None])
+                i += len(marker)
+                continue
+        buf.append(ch)
+        i += 1
+    flush()
+
+    # Unclosed markers were literal text after all
+    for kind, opener in openers.items():
+        if opener is not None:
+            index, marker, before_style = opener
+            runs[index] = [marker, before_style]
+            for run in runs[index + 1:]:
+                if run[1] is not None:
+                    run[1].pop(kind, None)
+
+    merged = []
+    for run_text, run_style in runs:
+        if not run_text:
+            continue
+        run_style = run_style or {}
+        if merged and merged[-1][1] == run_style:
+            merged[-1] = (merged[-1][0] + run_text, run_style)
+        else:
+            merged.append((run_text, run_style))
+    return merged
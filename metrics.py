@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from config import METRICS_PATH
+
+# Events emitted by this process, for the daemon's /metrics endpoint
+_recent = deque(maxlen=10000)
+_lock = threading.Lock()
+_file = None
+
+
+def record(event: str, **fields):
+    """Append one event to METRICS_PATH as a JSON line and keep it for in-process reporting."""
+    global _file
+    entry = {"ts": round(time.time(), 3), "event": event, **fields}
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with _lock:
+        _recent.append(entry)
+        if METRICS_PATH:
+            if _file is None:
+                _file = open(METRICS_PATH, "a", encoding="utf-8", buffering=1)
+            _file.write(line + "\n")
+
+
+def incr(name: str, value: float = 1, **labels):
+    """Count something that happened: a model fallback, a retry, a cache hit."""
+    record("counter", name=name, value=value, **labels)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Time a block as a span. The block can add fields (bytes, tokens, ...) to
+    the yielded dict; the span is recorded with `ok` False if it raised.
+    """
+    fields = {}
+    started_at = time.perf_counter()
+    ok = True
+    try:
+        yield fields
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        record("span", name=name, seconds=round(time.perf_counter() - started_at, 4), ok=ok, **labels, **fields)
+
+
+def load_events(path: str = METRICS_PATH):
+    """Read events back from a JSON lines file, skipping lines cut short by a crash."""
+    if not path or not os.path.exists(path):
+        return []
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events
+
+
+def percentile(sorted_values, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def aggregate(events) -> tuple[dict, dict]:
+    """
+    Summarise events into per-span and per-counter totals.
+
+    Returns:
+        tuple[dict, dict]: span name -> {seconds (sorted), errors, totals of numeric fields},
+        and (counter name, labels) -> total.
+    """
+    spans = defaultdict(lambda: {"seconds": [], "errors": 0, "totals": defaultdict(float)})
+    counters = defaultdict(float)
+    for event in events:
+        if event.get("event") == "span":
+            span = spans[event["name"]]
+            span["seconds"].append(event["seconds"])
+            span["errors"] += not event.get("ok", True)
+            for key, value in event.items():
+                if key not in ("ts", "seconds") and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    span["totals"][key] += value
+        elif event.get("event") == "counter":
+            labels = tuple(sorted((k, str(v)) for k, v in event.items() if k not in ("ts", "event", "name", "value")))
+            counters[(event["name"], labels)] += event.get("value", 1)
+    for span in spans.values():
+        span["seconds"].sort()
+    return spans, counters
+
+
+def format_report(events) -> str:
+    """Human-readable p50/p95 per span plus counter totals."""
+    spans, counters = aggregate(events)
+    lines = [f"{'span':<24}{'count':>7}{'errors':>8}{'p50 s':>9}{'p95 s':>9}{'max s':>9}  totals"]
+    for name, span in sorted(spans.items()):
+        seconds = span["seconds"]
+        totals = ", ".join(f"{key}={value:g}" for key, value in sorted(span["totals"].items()))
+        lines.append(
+            f"{name:<24}{len(seconds):>7}{span['errors']:>8}{percentile(seconds, 50):>9.2f}"
+            f"{percentile(seconds, 95):>9.2f}{seconds[-1]:>9.2f}  {totals}"
+        )
+    runs = [event for event in events if event.get("event") == "run"]
+    if runs:
+        last = runs[-1]
+        lines.append("")
+        lines.append(
+            f"{len(runs)} runs; last at {last.get('start_time')}: {last.get('converted_videos', 0)} converted, "
+            f"{last.get('failed_conversions', 0)} failed, {last.get('seconds', 0):g}s{'' if last.get('ok') else ' (crashed)'}"
+        )
+    if counters:
+        lines.append("")
+        for (name, labels), value in sorted(counters.items()):
+            label_text = ",".join(f"{k}={v}" for k, v in labels)
+            lines.append(f"{name}{'{' + label_text + '}' if label_text else ''} {value:g}")
+    return "\n".join(lines)
+
+
+def _prometheus_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_prometheus(events) -> str:
+    """Prometheus text exposition of span latencies (as summaries) and counters."""
+    spans, counters = aggregate(events)
+    lines = [
+        "# HELP youtube_summariser_span_seconds Wall time per pipeline span.",
+        "# TYPE youtube_summariser_span_seconds summary",
+    ]
+    for name, span in sorted(spans.items()):
+        seconds = span["seconds"]
+        for q in (0.5, 0.95):
+            labels = _prometheus_labels([("name", name), ("quantile", q)])
+            lines.append(f"youtube_summariser_span_seconds{labels} {percentile(seconds, q * 100)}")
+        labels = _prometheus_labels([("name", name)])
+        lines.append(f"youtube_summariser_span_seconds_sum{labels} {sum(seconds)}")
+        lines.append(f"youtube_summariser_span_seconds_count{labels} {len(seconds)}")
+    for name, span in sorted(spans.items()):
+        for key, value in sorted(span["totals"].items()):
+            lines.append(f"youtube_summariser_span_{key}_total{_prometheus_labels([('name', name)])} {value:g}")
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f"youtube_summariser_{name}_total{_prometheus_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def recent_events() -> list:
+    with _lock:
+        return list(_recent)
@@ -0,0 +1,247 @@
+import queue
+import threading
+import time
+
+import metrics
+import rate_limit
+from config import (
+    DEFAULT_MODEL_TIMEOUT,
+    GEMINI_MAX_RETRIES,
+    GEMINI_RETRY_BASE_SECONDS,
+    MODEL_CIRCUIT_BREAKER_COOLDOWN_SECONDS,
+    MODEL_CIRCUIT_BREAKER_THRESHOLD,
+    MODEL_HEDGE_AFTER_SECONDS,
+    MODEL_TIMEOUTS,
+)
+
+
+class AllModelsFailedError(Exception):
+    """Raised when every candidate model failed, timed out or was skipped."""
+
+
+class CircuitBreaker:
+    """
+    Skips a model for `cooldown_seconds` after repeated consecutive failures.
+
+    Once the cooldown is over the circuit is half-open: calls go through
+    again, a success closes it and a failure opens it for another cooldown.
+    """
+
+    def __init__(self, failure_threshold: int = MODEL_CIRCUIT_BREAKER_THRESHOLD,
+                 cooldown_seconds: float = MODEL_CIRCUIT_BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._failures = {}
+        self._opened_at = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, model_name: str) -> bool:
+        if not self.failure_threshold:
+            return False
+        with self._lock:
+            if self._failures.get(model_name, 0) < self.failure_threshold:
+                return False
+            return time.monotonic() - self._opened_at[model_name] < self.cooldown_seconds
+
+    def record_success(self, model_name: str):
+        with self._lock:
+            self._failures[model_name] = 0
+
+    def record_failure(self, model_name: str):
+        with self._lock:
+            self._failures[model_name] = self._failures.get(model_name, 0) + 1
+            failures = self._failures[model_name]
+            opened = self.failure_threshold and failures >= self.failure_threshold
+            if opened:
+                self._opened_at[model_name] = time.monotonic()
+        if opened:
+            print(f"🔌 Circuit open for {model_name} after {failures} consecutive failures, "
+                  f"skipping it for {self.cooldown_seconds:.0f}s.")
+
+
+# Shared by every call in the process, so one flaky model is skipped everywhere until its cooldown ends
+circuit_breaker = CircuitBreaker()
+
+
+def model_timeouts(model_name: str) -> dict:
+    """First-token and total deadlines (seconds) for a model."""
+    return {**DEFAULT_MODEL_TIMEOUT, **MODEL_TIMEOUTS.get(model_name, {})}
+
+
+def _stream_model(model_name, prompt, generation_config, events, cancelled):
+    """
+    Worker thread: stream one model and report chunks/completion/errors on `events`.
+
+    Each request goes through the Gemini rate limiter. A 429 or server error
+    before any text has streamed is retried with backoff (within the model's
+    deadlines, which keep running); after that the error is reported and the
+    next model takes over.
+    """
+    limiter = rate_limit.get_limiter("gemini")
+    attempt = 0
+    streamed = False
+    rate_limit.retry_budget.record_call()
+    try:
+        import google.generativeai as genai
+        model = genai.GenerativeModel(model_name)
+        while True:
+            limiter.acquire()
+            try:
+                response_stream = model.generate_content(prompt, stream=True, generation_config=generation_config)
+                for chunk in response_stream:
+                    if cancelled.is_set():
+                        return
+                    if chunk.text:
+                        streamed = True
+                        events.put(("chunk", model_name, chunk.text))
+                limiter.record_success()
+                events.put(("done", model_name, None))
+                return
+            except Exception as e:
+                kind = rate_limit.classify_http_error(e)
+                if streamed:
+                    # Text has already gone out, so the next model takes over instead of a retry
+                    if kind == rate_limit.THROTTLED:
+                        limiter.record_throttle()
+                    raise
+                delay = rate_limit.retry_delay("gemini", e, kind, attempt, GEMINI_MAX_RETRIES, GEMINI_RETRY_BASE_SECONDS)
+                if delay is None:
+                    raise
+                if cancelled.wait(delay):
+                    return
+                attempt += 1
+    except Exception as e:
+        events.put(("error", model_name, e))
+
+
+class _Attempt:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.timeouts = model_timeouts(model_name)
+        self.started_at = time.monotonic()
+        self.first_chunk_at = None
+        self.parts = []
+        self.hedged = False
+        self.cancelled = threading.Event()
+
+    def deadline(self) -> float:
+        if self.first_chunk_at is None:
+            return self.started_at + self.timeouts["first_token"]
+        return self.started_at + self.timeouts["total"]
+
+
+def stream_with_fallback(
+    prompt: str,
+    models_to_try: list,
+    generation_config: dict = None,
+    hedge_after: float = MODEL_HEDGE_AFTER_SECONDS,
+    breaker: CircuitBreaker = circuit_breaker,
+) -> tuple[str, str]:
+    """
+    Streams a response from the first model that completes within its deadlines.
+
+    Models are tried in order. A model that misses its first-token or total
+    deadline, or raises, counts as a failure and the next model is started.
+    With `hedge_after` set, if the newest attempt hasn't produced a first chunk
+    after that many seconds the next model is started in parallel, and
+    whichever finishes first wins.
+
+    Args:
+        prompt (str): Full prompt text.
+        models_to_try (list): Ordered list of Gemini model names.
+        generation_config (dict): Optional Gemini generation parameters.
+        hedge_after (float): Seconds without a first chunk before hedging; 0 disables hedging.
+        breaker (CircuitBreaker): Tracks failures and skips models whose circuit is open.
+
+    Returns:
+        tuple[str, str]: (model name, full response text).
+
+    Raises:
+        AllModelsFailedError: If no model produced a complete response.
+    """
+    candidates = [m for m in models_to_try if not breaker.is_open(m)]
+    skipped = [m for m in models_to_try if m not in candidates]
+    if skipped:
+        print(f"⏭️ Skipping models with open circuit: {', '.join(skipped)}")
+
+    events = queue.Queue()
+    active = {}
+
+    def start_next() -> bool:
+        if not candidates:
+            return False
+        model_name = candidates.pop(0)
+        print(f"Attempting to use model: {model_name}...")
+        attempt = _Attempt(model_name)
+        active[model_name] = attempt
+        threading.Thread(
+            target=_stream_model,
+            args=(model_name, prompt, generation_config, events, attempt.cancelled),
+            daemon=True,
+        ).start()
+        return True
+
+    def fail(attempt, reason):
+        attempt.cancelled.set()
+        del active[attempt.model_name]
+        breaker.record_failure(attempt.model_name)
+        metrics.incr("model_fallbacks", model=attempt.model_name)
+        print(f"❌ Error with {attempt.model_name}: {reason}")
+        if not active and candidates:
+            print("Trying next model...")
+            start_next()
+
+    start_next()
+    while active:
+        now = time.monotonic()
+        newest = max(active.values(), key=lambda a: a.started_at)
+        wake_at = min(a.deadline() for a in active.values())
+        can_hedge = hedge_after and candidates and not newest.hedged and newest.first_chunk_at is None
+        if can_hedge:
+            wake_at = min(wake_at, newest.started_at + hedge_after)
+
+        try:
+            kind, model_name, payload = events.get(timeout=max(0.0, wake_at - now))
+        except queue.Empty:
+            now = time.monotonic()
+            for attempt in list(active.values()):
+                if now >= attempt.deadline():
+                    stage = "first_token" if attempt.first_chunk_at is None else "total"
+                    fail(attempt, f"{stage.replace('_', ' ')} deadline of {attempt.timeouts[stage]}s exceeded")
+            if can_hedge and newest.model_name in active and now >= newest.started_at + hedge_after:
+                newest.hedged = True
+                metrics.incr("model_hedges", model=newest.model_name)
+                print(f"⏱️ No first chunk from {newest.model_name} after {hedge_after}s, hedging with the next model.")
+                start_next()
+            continue
+
+        attempt = active.get(model_name)
+        if attempt is None:
+            continue  # late event from an abandoned attempt
+        if kind == "chunk":
+            if attempt.first_chunk_at is None:
+                attempt.first_chunk_at = time.monotonic()
+                print(f"--- Streaming response from {model_name} ---")
+            attempt.parts.append(payload)
+        elif kind == "error":
+            fail(attempt, payload)
+        elif kind == "done" and not attempt.parts:
+            fail(attempt, "empty response")
+        elif kind == "done":
+            for other in active.values():
+                if other is not attempt:
+                    other.cancelled.set()
+            breaker.record_success(model_name)
+            response = "".join(attempt.parts)
+            metrics.record(
+                "span", name="gemini.first_token", model=model_name, ok=True,
+                seconds=round(attempt.first_chunk_at - attempt.started_at, 4),
+            )
+            metrics.record(
+                "span", name="gemini.generate", model=model_name, ok=True,
+                seconds=round(time.monotonic() - attempt.started_at, 4),
+                chars_in=len(prompt), chars_out=len(response),
+            )
+            return model_name, response
+
+    raise AllModelsFailedError("All Gemini models failed to generate content.")
@@ -0,0 +1,234 @@
+import os
+import re
+import socket
+import time
+import asyncio
+
+import metrics
+from config import (
+    CACHE_FOLDER,
+    VOICE_NOTES_FOLDER,
+    PIPELINE_CONCURRENCY,
+    TRANSCRIPT_CONCURRENCY,
+    GEMINI_CONCURRENCY,
+    TTS_CONCURRENCY,
+    JOB_LEASE_SECONDS,
+    DOCS_REPORTS,
+    DEDUP_ENABLED,
+)
+from videos_controller import get_repository, get_videos_without_voice_notes, update_docs_status, update_voice_note_status
+from gemini_ai import generate_docs_report, summarise_transcript
+from docs_updater import get_docs_sink
+from md2docs import markdown_to_document_structure
+from transcript_store import get_transcript
+from tts import choose_voice, convert_text_file_to_voice_note, link_or_copy
+from dedup import check_duplicate, unlink_duplicate
+from job_queue import FAILED
+
+source_folder = CACHE_FOLDER
+destination_folder = VOICE_NOTES_FOLDER
+
+# Stages each new video is queued for; the docs report shares the transcript with the voice note
+VIDEO_STAGES = ("transcript", "summary", "tts") + (("docs",) if DOCS_REPORTS else ())
+
+# Counters for the current run, reported by main.py and the daemon status endpoint
+run_stats = {
+    "converted_videos": 0,
+    "failed_conversions": 0,
+    "docs_reports": 0,
+    "deduplicated_videos": 0,
+}
+
+
+class Requeue(Exception):
+    """Raised by a stage handler to send its video back through `stages` instead of finishing the job."""
+
+    def __init__(self, stages, reason):
+        super().__init__(reason)
+        self.stages = stages
+
+
+def safe_title(title):
+    raw_title = title.split("—")[0].strip()
+    return re.sub(r"[^\w\-_.]", "_", raw_title)
+
+
+def summary_file_path(video_id, title):
+    return f"{source_folder}/{video_id}__{safe_title(title)}_voice_note.txt"
+
+
+def voice_note_file(video):
+    """Where a voiced video's mp3 is; derived the way tts names it for videos voiced before paths were stored."""
+    if video.get("voice_note_path"):
+        return video["voice_note_path"]
+    return os.path.join(destination_folder, f"{safe_title(video['title'])}_voice_note_{choose_voice(video['video_id'])}.mp3")
+
+
+async def run_transcript_stage(video):
+    transcript = await asyncio.to_thread(get_transcript, video["video_id"])
+    if DEDUP_ENABLED:
+        await asyncio.to_thread(check_duplicate, video["video_id"], transcript)
+
+
+async def link_duplicate_voice_note(video):
+    """
+    Link the original's mp3 under this video's title.
+
+    If the original's file is gone the video stops being a duplicate and is
+    sent back through the summary (and docs) stages it skipped, so those run
+    under their own concurrency limits.
+    """
+    original = get_repository().get_video(video["duplicate_of"])
+    source_path = voice_note_file(original) if original else None
+    if not (source_path and os.path.exists(source_path)):
+        transcript = await asyncio.to_thread(get_transcript, video["video_id"])
+        await asyncio.to_thread(unlink_duplicate, video["video_id"], video["duplicate_of"], transcript)
+        raise Requeue(VIDEO_STAGES[1:], f"voice note of {video['duplicate_of']} is missing")
+    voice_suffix = os.path.splitext(source_path)[0].rsplit("_", 1)[-1]
+    voice_note_path = os.path.join(destination_folder, f"{safe_title(video['title'])}_voice_note_{voice_suffix}.mp3")
+    os.makedirs(destination_folder, exist_ok=True)
+    if not os.path.exists(voice_note_path):
+        await asyncio.to_thread(link_or_copy, source_path, voice_note_path)
+    print(f"🔗 Linked voice note of {video['duplicate_of']} to {voice_note_path}")
+    update_voice_note_status(video["video_id"], voice_note_path)
+    run_stats["deduplicated_videos"] += 1
+
+
+async def run_summary_stage(video):
+    if video.get("duplicate_of"):
+        print(f"⏭️ Skipping summary for {video['title']}: near-duplicate of {video['duplicate_of']}")
+        return
+    print(f"\n🎬 Starting voice-note prompt generation for video: {video['title']}")
+    transcript = await asyncio.to_thread(get_transcript, video["video_id"])
+    path = summary_file_path(video["video_id"], video["title"])
+    summary = await asyncio.to_thread(summarise_transcript, transcript, path)
+    if not summary:
+        raise RuntimeError("no summary generated")
+    print(f"✅ Summary generated and saved to {path}")
+
+
+async def run_tts_stage(video):
+    if video.get("duplicate_of"):
+        await link_duplicate_voice_note(video)
+        return
+    path = summary_file_path(video["video_id"], video["title"])
+    if not os.path.exists(path):
+        # The summary file is removed after a successful conversion; if a previous
+        # attempt died after that point, the summary job rebuilds it (from the LLM
+        # cache) under its own concurrency limit.
+        raise Requeue(("summary", "tts"), "summary file missing")
+    voice_note_path = await convert_text_file_to_voice_note(path, destination_folder)
+    if voice_note_path is None:
+        raise RuntimeError("voice note was skipped")
+    print(f"✅ Voice note saved to {voice_note_path}")
+    update_voice_note_status(video["video_id"], voice_note_path)
+    run_stats["converted_videos"] += 1
+
+
+async def run_docs_stage(video):
+    if video.get("duplicate_of"):
+        print(f"⏭️ Skipping docs report for {video['title']}: the report of {video['duplicate_of']} covers it")
+        return
+    transcript = await asyncio.to_thread(get_transcript, video["video_id"])
+    report = await asyncio.to_thread(generate_docs_report, transcript, video["url"])
+    if not report:
+        raise RuntimeError("no docs report generated")
+    document_structure = markdown_to_document_structure(report)
+    # The sink serialises appends, so reports from concurrent jobs never interleave
+    await asyncio.to_thread(get_docs_sink().append, document_structure, video["video_id"])
+    update_docs_status(video["video_id"])
+    run_stats["docs_reports"] += 1
+    print(f"📑 Docs report appended for video: {video['title']}")
+
+
+STAGE_HANDLERS = {
+    "transcript": run_transcript_stage,
+    "summary": run_summary_stage,
+    "tts": run_tts_stage,
+    "docs": run_docs_stage,
+}
+
+
+async def run_job(job, job_queue, semaphores):
+    """Run one claimed job under its stage semaphore, heartbeating the lease meanwhile."""
+    video = get_repository().get_video(job.video_id)
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await asyncio.to_thread(job_queue.extend_lease, job)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    queued_at = time.perf_counter()
+    try:
+        async with semaphores[job.stage]:
+            with metrics.timed(f"stage.{job.stage}") as span:
+                span["wait_seconds"] = round(time.perf_counter() - queued_at, 4)
+                await STAGE_HANDLERS[job.stage](video)
+    finally:
+        heartbeat_task.cancel()
+
+
+def enqueue_pending_videos(job_queue) -> int:
+    """Queue every video without a voice note for all pipeline stages."""
+    return job_queue.enqueue([video_id for video_id, _ in get_videos_without_voice_notes()], VIDEO_STAGES)
+
+
+async def run_pipeline(job_queue, concurrency=PIPELINE_CONCURRENCY, stop_event=None, stages=None):
+    """
+    Drain the job queue with a bounded pool of workers.
+
+    Workers claim whichever stage of whichever video is runnable next, so TTS
+    for one video overlaps with summarisation of another. Per-stage semaphores
+    keep each API within its limits. Without `stop_event` this returns once
+    nothing is runnable and no job is in flight; jobs waiting on a retry
+    backoff are left for the next run. With `stop_event` the workers keep
+    polling for new jobs until the event is set, then finish their current
+    job and return. `stages` limits the workers to a subset of STAGE_HANDLERS.
+    """
+    semaphores = {
+        "transcript": asyncio.Semaphore(TRANSCRIPT_CONCURRENCY),
+        "summary": asyncio.Semaphore(GEMINI_CONCURRENCY),
+        "tts": asyncio.Semaphore(TTS_CONCURRENCY),
+    }
+    # Report generation is a Gemini call too, so it shares the summary limit
+    semaphores["docs"] = semaphores["summary"]
+    stages = list(stages or STAGE_HANDLERS)
+    in_flight = 0
+    job_finished = asyncio.Event()
+
+    async def worker(n):
+        nonlocal in_flight
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{n}"
+        while not (stop_event and stop_event.is_set()):
+            busy = in_flight
+            job = await asyncio.to_thread(job_queue.claim, worker_id, stages)
+            if job is None:
+                if stop_event is None and busy == 0 and in_flight == 0:
+                    return
+                # Another job in flight may unlock the next stage of its video
+                job_finished.clear()
+                try:
+                    await asyncio.wait_for(job_finished.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            in_flight += 1
+            try:
+                await run_job(job, job_queue, semaphores)
+                await asyncio.to_thread(job_queue.complete, job)
+            except Requeue as e:
+                await asyncio.to_thread(job_queue.requeue, job.video_id, e.stages)
+                print(f"🔁 {job.video_id} queued again for {', '.join(e.stages)}: {e}")
+            except Exception as e:
+                state = await asyncio.to_thread(job_queue.fail, job, e)
+                metrics.incr("job_failures", stage=job.stage, state=state)
+                if state == FAILED:
+                    run_stats["failed_conversions"] += 1
+                print(f"❌ Error in {job.stage} for video {job.video_id} (attempt {job.attempts}, now {state}): {e}")
+            finally:
+                in_flight -= 1
+                job_finished.set()
+
+    await asyncio.gather(*(worker(n) for n in range(max(1, concurrency))))
@@ -0,0 +1,249 @@
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+from config import (
+    RATE_LIMIT_BACKOFF_FACTOR,
+    RATE_LIMIT_INCREASE_STEP,
+    RATE_LIMITS,
+    RETRY_BUDGET_MIN_PER_SECOND,
+    RETRY_BUDGET_RATIO,
+)
+
+# How a failed call is treated: THROTTLED lowers the service's rate and is retried,
+# TRANSIENT is only retried, anything else (None) is raised straight away
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+
+DEFAULT_RATE_LIMIT = {"rate": 2, "min_rate": 0.1, "max_rate": 10, "burst": 4}
+MAX_BACKOFF_SECONDS = 300
+
+
+class RateLimiter:
+    """
+    Token bucket whose rate adapts to the service (AIMD).
+
+    Every success raises the rate by RATE_LIMIT_INCREASE_STEP of `max_rate`;
+    a throttled response multiplies it by RATE_LIMIT_BACKOFF_FACTOR, at most
+    once per refill interval so a burst of 429s from calls already in flight
+    only counts once. The rate stays within [min_rate, max_rate]. Safe to
+    share between threads and the event loop.
+    """
+
+    def __init__(self, name: str, rate: float, min_rate: float, max_rate: float, burst: float):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token, possibly one that hasn't been refilled yet. Returns seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            metrics.incr("rate_limit_wait_seconds", round(wait, 3), service=self.name)
+        return wait
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        import asyncio
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def record_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_LIMIT_INCREASE_STEP)
+
+    def record_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < 1 / self.rate:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * RATE_LIMIT_BACKOFF_FACTOR)
+            rate = self.rate
+        metrics.incr("throttles", service=self.name)
+        print(f"🚦 {self.name} is throttling, lowered to {rate:.2f} requests/s")
+
+
+class RetryBudget:
+    """
+    Caps retries across every service: over the last `window_seconds`, at most
+    `ratio` retries per first attempt, plus `min_per_second` so a quiet
+    process can still retry. Stops retry storms when a service is down.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+                 window_seconds: float = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window_seconds = window_seconds
+        self._calls = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for timestamps in (self._calls, self._retries):
+            while timestamps and timestamps[0] < now - self.window_seconds:
+                timestamps.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append(now)
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget. Returns False if there's none left."""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = self.ratio * len(self._calls) + self.min_per_second * self.window_seconds
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+# Fraction of each service's limits this process may use, see set_share
+_share = 1.0
+# Shared by every service, so one failing API can't starve the others of retries
+retry_budget = RetryBudget()
+
+
+def set_share(share: float):
+    """Scale every limit by `share`, for one of several worker processes splitting the same API quotas."""
+    global _share
+    with _limiters_lock:
+        _share = share
+        _limiters.clear()
+
+
+def get_limiter(service: str) -> RateLimiter:
+    """Process-wide limiter per service, configured from RATE_LIMITS."""
+    with _limiters_lock:
+        if service not in _limiters:
+            limits = {**DEFAULT_RATE_LIMIT, **RATE_LIMITS.get(service, {})}
+            _limiters[service] = RateLimiter(
+                service,
+                rate=limits["rate"] * _share,
+                min_rate=limits["min_rate"] * _share,
+                max_rate=limits["max_rate"] * _share,
+                burst=max(1, limits["burst"] * _share),
+            )
+        return _limiters[service]
+
+
+def http_status(err):
+    """HTTP status of an API error (googleapiclient, google.api_core, aiohttp), if it has one."""
+    resp = getattr(err, "resp", None)
+    for status in (getattr(resp, "status", None), getattr(err, "status", None), getattr(err, "code", None)):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def classify_http_error(err):
+    """429 means slow down; other rate-limit/server statuses are worth a retry."""
+    status = http_status(err)
+    if status == 429:
+        return THROTTLED
+    if status in (500, 502, 503, 504):
+        return TRANSIENT
+    return None
+
+
+def backoff_delay(attempt: int, base_seconds: float) -> float:
+    """Exponential backoff with ±50% jitter, so clients that failed together don't retry together."""
+    return min(MAX_BACKOFF_SECONDS, base_seconds * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def retry_delay(service, err, kind, attempt, max_retries, base_seconds):
+    """
+    Feed a failed call back into the service's limiter and decide whether to retry.
+
+    Returns:
+        float | None: Seconds to wait before the next attempt, or None to give up.
+    """
+    if kind == THROTTLED:
+        get_limiter(service).record_throttle()
+    if kind is None or attempt >= max_retries:
+        return None
+    reason = f"{type(err).__name__}: {err}"
+    if not retry_budget.try_spend():
+        metrics.incr("retry_budget_exhausted", service=service)
+        print(f"🪫 Retry budget exhausted, giving up on {service} ({reason})")
+        return None
+    delay = backoff_delay(attempt, base_seconds)
+    metrics.incr("retries", service=service, reason=kind)
+    print(f"⚠️ {service} call failed ({reason}), retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+    return delay
+
+
+def call_with_retry(service: str, fn, classify=classify_http_error, max_retries: int = 3, base_seconds: float = 1):
+    """
+    Call `fn()` under the service's rate limiter, retrying what `classify` allows.
+
+    Args:
+        service (str): Key into RATE_LIMITS.
+        fn (callable): The API call, with no arguments.
+        classify (callable): Maps an exception to THROTTLED, TRANSIENT or None (don't retry).
+        max_retries (int): Retries after the first attempt, also bounded by the global retry budget.
+        base_seconds (float): Backoff before the first retry, doubled per attempt.
+    """
+    limiter = get_limiter(service)
+    attempt = 0
+    retry_budget.record_call()
+    while True:
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as err:
+            delay = retry_delay(service, err, classify(err), attempt, max_retries, base_seconds)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+        else:
+            limiter.record_success()
+            return result
+
+
+async def call_with_retry_async(service: str, fn, classify=classify_http_error, max_retries: int = 3,
+                                base_seconds: float = 1):
+    """Like call_with_retry, for a coroutine function `fn`."""
+    import asyncio  # not at module level: the sync-only CLI paths shouldn't pay for it
+    limiter = get_limiter(service)
+    attempt = 0
+    retry_budget.record_call()
+    while True:
+        await limiter.acquire_async()
+        try:
+            result = await fn()
+        except Exception as err:
+            delay = retry_delay(service, err, classify(err), attempt, max_retries, base_seconds)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+        else:
+            limiter.record_success()
+            return result
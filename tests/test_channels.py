@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_fakes import install_config
+
+
+@pytest.fixture
+def videos_controller(tmp_path, monkeypatch):
+    install_config(str(tmp_path))
+    import videos_controller
+    repository = videos_controller.VideoRepository(str(tmp_path / "youtube_video_data.db"))
+    monkeypatch.setattr(videos_controller, "get_repository", lambda: repository)
+    return videos_controller
+
+
+def polled_channels(videos_controller, monkeypatch) -> list:
+    """Channel ids that one forced sync_subscribed_channels() run polls."""
+    polled = []
+    monkeypatch.setattr(videos_controller, "sync_channel", lambda channel_id, *args: polled.append(channel_id) or (0, 0))
+    videos_controller.sync_subscribed_channels(force=True, youtube=object())
+    return sorted(polled)
+
+
+def test_removed_channel_is_no_longer_polled(videos_controller, monkeypatch):
+    monkeypatch.setattr(videos_controller, "CHANNEL_IDS", ["UCkept", "UCremoved"])
+    assert polled_channels(videos_controller, monkeypatch) == ["UCkept", "UCremoved"]
+
+    monkeypatch.setattr(videos_controller, "CHANNEL_IDS", ["UCkept"])
+    assert polled_channels(videos_controller, monkeypatch) == ["UCkept"]
+    repository = videos_controller.get_repository()
+    assert [row[0] for row in repository.get_channels()] == ["UCkept"]
+    assert "UCremoved" not in repository.get_due_channels()
+
+
+def test_switching_from_channel_id_to_channel_ids(videos_controller, monkeypatch):
+    monkeypatch.setattr(videos_controller, "CHANNEL_IDS", [])
+    monkeypatch.setattr(videos_controller, "CHANNEL_ID", "UCsingle")
+    assert polled_channels(videos_controller, monkeypatch) == ["UCsingle"]
+
+    monkeypatch.setattr(videos_controller, "CHANNEL_IDS", ["UCfirst", "UCsecond"])
+    assert polled_channels(videos_controller, monkeypatch) == ["UCfirst", "UCsecond"]
+
+
+def test_channel_added_back_is_due_again(videos_controller):
+    repository = videos_controller.get_repository()
+    repository.subscribe_channels(["UCa", "UCb"])
+    repository.schedule_next_poll("UCb", 60)
+    repository.subscribe_channels(["UCa"])
+    repository.subscribe_channels(["UCa", "UCb"])
+    assert sorted(repository.get_due_channels()) == ["UCa", "UCb"]
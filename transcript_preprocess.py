@@ -0,0 +1,58 @@
+import re
+from collections import deque
+
+from config import TRANSCRIPT_DROP_SPONSOR_SEGMENTS
+
+# Non-speech caption tags: [Music], [Applause], (laughter), ♪ ... ♪
+NON_SPEECH_RE = re.compile(
+    r"\[[^\]]{0,40}\]|\((?:music|applause|laughter|laughs|inaudible|silence)[^)]{0,20}\)|♪+",
+    re.IGNORECASE,
+)
+# "mm" is left alone: it's also the unit
+FILLER_RE = re.compile(r"\b(?:u+[hm]+|e+r+m+|h+m+|m{3,}|m+h+m+)\b[,.]?", re.IGNORECASE)
+SPONSOR_RE = re.compile(
+    r"sponsored by|this video is sponsored|today's sponsor|promo code|discount code|use code \w+"
+    r"|patreon\.com|hit the bell|like and subscribe|don't forget to subscribe",
+    re.IGNORECASE,
+)
+# Rolling auto-captions repeat at most a line of the previous segment
+MAX_OVERLAP_WORDS = 16
+PUNCTUATION = ".,!?;:\"'"
+
+
+def _overlap(tail, words) -> int:
+    """Longest k such that the last k words already emitted equal the first k new ones."""
+    for k in range(min(len(tail), len(words)), 0, -1):
+        if all(tail[len(tail) - k + i] == words[i] for i in range(k)):
+            return k
+    return 0
+
+
+def preprocess_transcript(transcript: dict, drop_sponsors: bool = TRANSCRIPT_DROP_SPONSOR_SEGMENTS) -> dict:
+    """
+    Returns a copy of a transcript record cleaned up for prompting.
+
+    Per segment, in one pass: non-speech tags and filler words are removed,
+    whitespace is collapsed, text the previous segment already said (rolling
+    auto-caption overlap) is dropped, and with `drop_sponsors` segments with
+    sponsor/call-to-action phrases are skipped. Overlap matching is bounded by
+    MAX_OVERLAP_WORDS, so the whole pass is linear in transcript size. Segment
+    timings are kept.
+    """
+    segments = []
+    tail = deque(maxlen=MAX_OVERLAP_WORDS)  # normalised last words emitted
+    for segment in transcript["segments"]:
+        text = FILLER_RE.sub("", NON_SPEECH_RE.sub(" ", segment["text"]))
+        words = text.split()
+        if not words or (drop_sponsors and SPONSOR_RE.search(text)):
+            continue
+        normalised = [word.strip(PUNCTUATION).lower() for word in words]
+        k = _overlap(tail, normalised[:MAX_OVERLAP_WORDS])
+        # A single repeated word is usually real speech ("very, very"), unless it's the whole segment
+        if k == 1 and len(words) > 1:
+            k = 0
+        if k == len(words):
+            continue
+        tail.extend(normalised[k:])
+        segments.append({**segment, "text": " ".join(words[k:])})
+    return {**transcript, "segment_count": len(segments), "segments": segments}
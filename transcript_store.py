@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import metrics
+import rate_limit
+from buffered_io import BufferedStreamWriter
+from config import TRANSCRIPT_CACHE_FOLDER, TRANSCRIPT_LANGUAGES
+
+
+def transcript_path(video_id: str, language: str) -> str:
+    """Path of the cached transcript for a video in a given language."""
+    return os.path.join(TRANSCRIPT_CACHE_FOLDER, f"{video_id}.{language}.json")
+
+
+def load_transcript(video_id: str, languages=None) -> dict | None:
+    """Return the cached transcript for the first available language, or None."""
+    for language in languages or TRANSCRIPT_LANGUAGES:
+        path = transcript_path(video_id, language)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    return None
+
+
+def save_transcript(transcript: dict) -> str:
+    """Write a transcript record atomically so parallel readers never see half a file."""
+    os.makedirs(TRANSCRIPT_CACHE_FOLDER, exist_ok=True)
+    path = transcript_path(transcript["video_id"], transcript["language"])
+    with BufferedStreamWriter(path) as f:
+        json.dump(transcript, f, ensure_ascii=False)
+    return path
+
+
+def classify_transcript_error(err):
+    """YouTube answers transcript scraping that's too fast with 429s or an IP block."""
+    if type(err).__name__ in ("RequestBlocked", "IpBlocked", "TooManyRequests"):
+        return rate_limit.THROTTLED
+    return rate_limit.classify_http_error(err)
+
+
+def get_transcript(video_id: str, languages=None) -> dict:
+    """
+    Returns the transcript for a video, downloading it from YouTube only on a cache miss.
+
+    Args:
+        video_id (str): YouTube video id.
+        languages (list): Preferred language codes, in order. Defaults to TRANSCRIPT_LANGUAGES.
+
+    Returns:
+        dict: Transcript record with `video_id`, `language`, `is_generated`,
+        `fetched_at`, `segment_count` and `segments` ({text, start, duration}).
+    """
+    languages = list(languages or TRANSCRIPT_LANGUAGES)
+    cached = load_transcript(video_id, languages)
+    if cached is not None:
+        print(f"📄 Transcript cache hit for {video_id} ({cached['language']})")
+        metrics.incr("transcript_cache_hits")
+        return cached
+
+    from youtube_transcript_api import YouTubeTranscriptApi
+    with metrics.timed("transcript.fetch") as span:
+        # No retries here, a failed fetch is retried by the job queue; the limiter still learns from 429s
+        fetched = rate_limit.call_with_retry(
+            "transcripts", lambda: YouTubeTranscriptApi().fetch(video_id, languages=languages),
+            classify=classify_transcript_error, max_retries=0,
+        )
+        segments = [
+            {"text": snippet.text, "start": snippet.start, "duration": snippet.duration}
+            for snippet in fetched
+            if snippet.text
+        ]
+        span["segments"] = len(segments)
+        span["chars_out"] = sum(len(segment["text"]) for segment in segments)
+    transcript = {
+        "video_id": video_id,
+        "language": fetched.language_code,
+        "is_generated": fetched.is_generated,
+        "fetched_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "segment_count": len(segments),
+        "segments": segments,
+    }
+    save_transcript(transcript)
+    print(f"📄 Transcript fetched for {video_id}: {len(segments)} segments ({transcript['language']})")
+    return transcript
+
+
+def transcript_text(transcript: dict) -> str:
+    """Join transcript segments into a single string, one space between segments."""
+    # Caption text carries its own line breaks; collapse them so adjacent words never run together
+    return " ".join(" ".join(segment["text"].split()) for segment in transcript["segments"])
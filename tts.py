@@ -1,8 +1,31 @@
 import os
-import edge_tts
-import random
+import re
+import time
+import hashlib
+import shutil
+import asyncio
 
-from config import CACHE_FOLDER, VOICE_NOTES_FOLDER
+import metrics
+import rate_limit
+from config import (
+    CACHE_FOLDER,
+    VOICE_NOTES_FOLDER,
+    TTS_CONCURRENCY,
+    TTS_MAX_RETRIES,
+    TTS_RETRY_BASE_SECONDS,
+    TTS_SEGMENT_MAX_CHARS,
+    TTS_SEGMENT_CONCURRENCY,
+    TTS_CACHE_FOLDER,
+    TTS_CACHE_MAX_BYTES,
+    TTS_CACHE_MAX_AGE_DAYS,
+    VOICE_OVERRIDES,
+)
+
+def transient_tts_errors():
+    """Network-level failures worth retrying; anything else (bad voice, bad text) fails fast."""
+    import aiohttp
+    from edge_tts.exceptions import NoAudioReceived, WebSocketError
+    return (NoAudioReceived, WebSocketError, aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)
 
 VOICE_LIST = [
     {
@@ -63,8 +86,221 @@ VOICE_LIST = [
     }
 ]
 
+FAV_CHARACTERS = ["Ana","Aria", "Eric", "Guy", "Jenny","Roger",]
+
+def choose_voice(video_id):
+    """Pick the voice for a video: VOICE_OVERRIDES first, otherwise a stable hash of the video id."""
+    if video_id in VOICE_OVERRIDES:
+        return VOICE_OVERRIDES[video_id]
+    digest = hashlib.sha256(video_id.encode("utf-8")).digest()
+    return FAV_CHARACTERS[int.from_bytes(digest[:8], "big") % len(FAV_CHARACTERS)]
+
+def tts_cache_path(text, voice):
+    """Cache location of the mp3 for (text, voice)."""
+    key = hashlib.sha256(f"{voice}\0{text}".encode("utf-8")).hexdigest()
+    return os.path.join(TTS_CACHE_FOLDER, f"{key}.mp3")
+
+def link_or_copy(src, dest):
+    """Hard-link `src` to `dest` (falling back to a copy across filesystems), replacing `dest`."""
+    tmp_path = f"{dest}.part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+async def synthesise_cached(text, voice, dest_path):
+    """Synthesise `text` to `dest_path` unless the same (text, voice) pair was already synthesised.
+
+    Returns True on a cache hit. Reruns with the same text and voice just
+    link the cached mp3 into place.
+    """
+    cache_path = tts_cache_path(text, voice)
+    if os.path.exists(cache_path):
+        os.utime(cache_path)  # mark as recently used for eviction
+        if not (os.path.exists(dest_path) and os.path.samefile(cache_path, dest_path)):
+            link_or_copy(cache_path, dest_path)
+        return True
+
+    await synthesise_segmented(text, voice, dest_path)
+    os.makedirs(TTS_CACHE_FOLDER, exist_ok=True)
+    link_or_copy(dest_path, cache_path)
+    evict_tts_cache()
+    return False
+
+def evict_tts_cache():
+    """Drop cached mp3s older than TTS_CACHE_MAX_AGE_DAYS, then the oldest until under TTS_CACHE_MAX_BYTES."""
+    if not os.path.isdir(TTS_CACHE_FOLDER):
+        return
+    now = time.time()
+    entries = []
+    for entry in os.scandir(TTS_CACHE_FOLDER):
+        if not entry.name.endswith(".mp3"):
+            continue
+        stat = entry.stat()
+        if TTS_CACHE_MAX_AGE_DAYS and now - stat.st_mtime > TTS_CACHE_MAX_AGE_DAYS * 86400:
+            os.remove(entry.path)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if not TTS_CACHE_MAX_BYTES or total <= TTS_CACHE_MAX_BYTES:
+        return
+    for _, size, path in sorted(entries):
+        if total <= TTS_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+async def convert_text_file_to_voice_note(source_path, destination_folder):
+    """Convert a single `<video_id>__<name>.txt` summary into an mp3 voice note.
+
+    Returns the mp3 path, or None if the file was skipped.
+    """
+    filename = os.path.basename(source_path)
+
+    file = filename[:-4]  # removes '.txt'
+    parts = file.split("__", 1)  # split only first two underscores
+
+    if len(parts) != 2:
+        print(f"⚠️ Skipped invalid filename: {filename}")
+        return None
+    file_id, name = parts        
+    voice_suffix = choose_voice(file_id)
+    voice = f"en-US-{voice_suffix}Neural"
+    dest_filename = f"{name}_{voice_suffix}.mp3"
+    dest_path = os.path.join(destination_folder, dest_filename)
+
+    with open(source_path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+
+    if not text:
+        print(f"⚠️ Skipped empty file: {filename}")
+        return None
+
+    print(f"🎙️ Processing: {name} → {dest_filename}")
+
+    os.makedirs(destination_folder, exist_ok=True)
+    if await synthesise_cached(f'i am {voice_suffix}'+text, voice, dest_path):
+        print(f"♻️ Reused cached audio for {dest_filename}")
+    os.remove(source_path)  # Remove the cached source file only once the mp3 is complete
+    return dest_path
+
+def classify_tts_error(err):
+    """
+    edge-tts rarely answers 429: no audio, or a refused websocket handshake, is how it says slow down.
+    Other network failures (dropped connections, timeouts) are retried without lowering the rate.
+    """
+    import aiohttp
+    from edge_tts.exceptions import NoAudioReceived
+    if isinstance(err, (NoAudioReceived, aiohttp.WSServerHandshakeError)):
+        return rate_limit.THROTTLED
+    if isinstance(err, transient_tts_errors()):
+        return rate_limit.TRANSIENT
+    return rate_limit.classify_http_error(err)
+
+async def synthesise_with_retry(text, voice, dest_path):
+    """Synthesise `text` to `dest_path` under the edge-tts rate limiter, retrying transient failures with backoff.
+
+    Audio is written to a temporary file and renamed into place on success, so
+    `dest_path` either doesn't exist or is a complete mp3.
+    """
+    import edge_tts
+    tmp_path = f"{dest_path}.part"
+
+    async def synthesise():
+        try:
+            with metrics.timed("tts.synthesise", voice=voice) as span:
+                span["chars_in"] = len(text)
+                tts = edge_tts.Communicate(text=text, voice=voice)
+                await tts.save(tmp_path)
+                span["bytes_out"] = os.path.getsize(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, dest_path)
+        return dest_path
+
+    return await rate_limit.call_with_retry_async(
+        "edge_tts", synthesise, classify=classify_tts_error,
+        max_retries=TTS_MAX_RETRIES - 1, base_seconds=TTS_RETRY_BASE_SECONDS,
+    )
+
+def split_script(text, max_chars=TTS_SEGMENT_MAX_CHARS):
+    """Split a script into segments of at most `max_chars`, on paragraph or sentence boundaries.
+
+    Consecutive short sentences are packed into one segment; a single sentence
+    longer than `max_chars` is split on whitespace.
+    """
+    segments = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        # Paragraph boundaries are natural pauses, so flush before starting a new one
+        if current and len(current) + 1 + len(paragraph) > max_chars:
+            segments.append(current)
+            current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                if current:
+                    segments.append(current)
+                    current = ""
+                segments.append(sentence[:cut])
+                sentence = sentence[cut:].lstrip()
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                segments.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+async def synthesise_segmented(text, voice, dest_path):
+    """Synthesise a long script as independent segments and join them into one mp3.
+
+    Segments are synthesised concurrently (TTS_SEGMENT_CONCURRENCY) into part
+    files next to `dest_path`, each with its own retries, so a network hiccup
+    only costs that segment. Parts are appended to the output in order as soon
+    as they're ready and deleted, keeping memory flat regardless of script length.
+    edge-tts emits raw MP3 frames, so byte concatenation yields a valid mp3.
+    """
+    segments = split_script(text)
+    parts_folder = f"{dest_path}.parts"
+    os.makedirs(parts_folder, exist_ok=True)
+    semaphore = asyncio.Semaphore(TTS_SEGMENT_CONCURRENCY)
+
+    async def synthesise(index, segment):
+        part_path = os.path.join(parts_folder, f"{index:05d}.mp3")
+        async with semaphore:
+            return await synthesise_with_retry(segment, voice, part_path)
+
+    tasks = [asyncio.create_task(synthesise(i, segment)) for i, segment in enumerate(segments)]
+    tmp_path = f"{dest_path}.part"
+    try:
+        with open(tmp_path, "wb") as out:
+            for task in tasks:
+                part_path = await task
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(part_path)
+        os.replace(tmp_path, dest_path)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        shutil.rmtree(parts_folder, ignore_errors=True)
+    return dest_path
+
 async def convert_text_to_voice_notes(source_folder, destination_folder):
-    fav_characters = ["Ana","Aria", "Eric", "Guy", "Jenny","Roger",]
     # Ensure destination folder exists
     os.makedirs(destination_folder, exist_ok=True)
 
@@ -77,38 +313,24 @@ async def convert_text_to_voice_notes(source_folder, destination_folder):
 
     print(f"🔄 Converting {len(txt_files)} text files to voice notes \n")
 
-    for filename in txt_files:
-        source_path = os.path.join(source_folder, filename)
-        voice_suffix =random.choice(fav_characters)
-        voice = f"en-US-{voice_suffix}Neural"
-
-        file = filename[:-4]  # removes '.txt'
-        parts = file.split("__", 1)  # split only first two underscores
+    semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
 
-        if len(parts) != 2:
-            print(f"⚠️ Skipped invalid filename: {filename}")
-            continue  
-        file_id, name = parts        
-        dest_filename = f"{name}_{voice_suffix}.mp3"
-        dest_path = os.path.join(destination_folder, dest_filename)
+    async def convert(filename):
+        async with semaphore:
+            source_path = os.path.join(source_folder, filename)
+            return await convert_text_file_to_voice_note(source_path, destination_folder)
 
-        with open(source_path, "r", encoding="utf-8") as f:
-            text = f.read().strip()
-
-        if not text:
-            print(f"⚠️ Skipped empty file: {filename}")
-            continue
-
-        print(f"🎙️ Processing: {name} → {dest_filename}")
-
-        tts = edge_tts.Communicate(text=f'i am {voice_suffix}'+text, voice=voice)
-        await tts.save(dest_path)
-        os.remove(source_path)  # Remove the cached source file after conversion
+    results = await asyncio.gather(*(convert(f) for f in txt_files), return_exceptions=True)
+    failed = 0
+    for filename, result in zip(txt_files, results):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"❌ TTS failed for {filename}: {result}")
+    if failed:
+        print(f"\n⚠️ {failed} of {len(txt_files)} files failed, their summaries were kept in {source_folder}")
     print("\n✅ Done! All voice notes saved in:", destination_folder)
     
 if __name__ == "__main__":
-    import asyncio
-
     source_folder = CACHE_FOLDER
     destination_folder = VOICE_NOTES_FOLDER 
     asyncio.run(convert_text_to_voice_notes(source_folder, destination_folder)) 
@@ -1,135 +1,631 @@
 # fetch_youtube_videos.py
 
-import sqlite3 
-import googleapiclient.discovery
-from config import YOUTUBE_API_KEY, CHANNEL_ID, LOOKBACK_HOURS
-
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import metrics
+import rate_limit
+from config import (
+    YOUTUBE_API_KEY,
+    CHANNEL_ID,
+    CHANNEL_IDS,
+    CHANNEL_POLL_MIN_MINUTES,
+    CHANNEL_POLL_MAX_MINUTES,
+    CHANNEL_SYNC_CONCURRENCY,
+    LOOKBACK_HOURS,
+    SYNC_BACKFILL_ALL,
+    SYNC_MAX_PAGES,
+    YOUTUBE_DAILY_QUOTA,
+    YOUTUBE_MAX_RETRIES,
+    YOUTUBE_RETRY_BASE_SECONDS,
+)
+
+# Use an absolute path to the DB file, relative to this script's directory
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "youtube_video_data.db")
+
+# YouTube Data API quota cost per call, see https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {"search.list": 100, "playlistItems.list": 1, "channels.list": 1}
+# The daily quota resets at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+
+class VideoRepository:
+    """Data-access layer for the videos table over one long-lived SQLite connection.
+
+    The connection runs in WAL mode so readers don't block the writer, and is
+    shared between threads behind a lock. Writes are batched: bulk inserts go
+    through `executemany` with INSERT OR IGNORE and status updates for many
+    videos commit in a single transaction.
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_schema()
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements under the lock as one transaction."""
+        with self._lock:
+            try:
+                yield self._conn
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def create_schema(self):
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    published_at TEXT,
+                    description TEXT,
+                    url TEXT,
+                    voice_note_generated INTEGER DEFAULT 0,
+                    data_updated_in_docs INTEGER DEFAULT 0,
+                    channel_id TEXT
+                )
+            """)
+            # Databases created before multi-channel support lack channel_id
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(videos)")}
+            if "channel_id" not in columns:
+                conn.execute("ALTER TABLE videos ADD COLUMN channel_id TEXT")
+            for column, column_type in (("voice_note_path", "TEXT"), ("duplicate_of", "TEXT"), ("similarity", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE videos ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_channel_id ON videos (channel_id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS channels (
+                    channel_id TEXT PRIMARY KEY,
+                    poll_interval_minutes INTEGER,
+                    next_poll_at TEXT,
+                    last_polled_at TEXT,
+                    added_at TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS channel_sync (
+                    channel_id TEXT PRIMARY KEY,
+                    uploads_playlist_id TEXT,
+                    last_video_id TEXT,
+                    last_published_at TEXT,
+                    last_synced_at TEXT,
+                    resume_page_token TEXT
+                )
+            """)
+            if "resume_page_token" not in {row[1] for row in conn.execute("PRAGMA table_info(channel_sync)")}:
+                conn.execute("ALTER TABLE channel_sync ADD COLUMN resume_page_token TEXT")
+            # MinHash signature of each indexed transcript, and its LSH band buckets (see dedup.py)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS transcript_signatures (
+                    video_id TEXT PRIMARY KEY,
+                    shingle_count INTEGER,
+                    signature BLOB,
+                    indexed_at TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS lsh_buckets (
+                    band INTEGER,
+                    bucket INTEGER,
+                    video_id TEXT,
+                    PRIMARY KEY (band, bucket, video_id)
+                ) WITHOUT ROWID
+            """)
+            # How far each video's Docs report got, so a report cut short part-way is resumed, not re-appended
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS docs_appends (
+                    video_id TEXT PRIMARY KEY,
+                    document_id TEXT,
+                    start_index INTEGER,
+                    batches_sent INTEGER,
+                    requests_digest TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_quota (
+                    day TEXT,
+                    endpoint TEXT,
+                    units INTEGER DEFAULT 0,
+                    PRIMARY KEY (day, endpoint)
+                )
+            """)
+
+    def upsert_videos(self, rows) -> int:
+        """Insert (video_id, title, published_at, description, url, channel_id) rows, skipping known videos.
+
+        Returns the number of new videos stored.
+        """
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("""
+                INSERT OR IGNORE INTO videos (video_id, title, published_at, description, url, channel_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            return conn.total_changes - before
+
+    def subscribe_channels(self, channel_ids):
+        """Make the subscription list exactly `channel_ids`: new channels are due for polling
+        immediately, and channels no longer listed are dropped so they stop using quota.
+
+        Their videos and sync state are kept, so a channel added back resumes where it left off.
+        """
+        channel_ids = list(channel_ids)
+        now = utc_now()
+        with self.transaction() as conn:
+            conn.execute(
+                f"DELETE FROM channels WHERE channel_id NOT IN ({', '.join('?' * len(channel_ids))})",
+                channel_ids,
+            )
+            conn.executemany("""
+                INSERT OR IGNORE INTO channels (channel_id, poll_interval_minutes, next_poll_at, added_at)
+                VALUES (?, ?, ?, ?)
+            """, [(channel_id, CHANNEL_POLL_MIN_MINUTES, now, now) for channel_id in channel_ids])
+
+    def get_due_channels(self) -> list:
+        """Subscribed channels whose next poll time has passed."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT channel_id FROM channels WHERE next_poll_at <= ? ORDER BY next_poll_at",
+                (utc_now(),),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_channels(self) -> list:
+        with self._lock:
+            return self._conn.execute("""
+                SELECT channel_id, poll_interval_minutes, next_poll_at, last_polled_at FROM channels
+                ORDER BY channel_id
+            """).fetchall()
+
+    def recent_upload_times(self, channel_id, limit: int = 10) -> list:
+        """Publish times of a channel's latest stored videos, newest first."""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT published_at FROM videos WHERE channel_id = ?
+                ORDER BY published_at DESC LIMIT ?
+            """, (channel_id, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def newest_video(self, channel_id) -> tuple:
+        """(video_id, published_at) of a channel's latest stored video, or (None, None)."""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT video_id, published_at FROM videos WHERE channel_id = ?
+                ORDER BY published_at DESC LIMIT 1
+            """, (channel_id,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def schedule_next_poll(self, channel_id, interval_minutes: int):
+        now = datetime.now(timezone.utc)
+        next_poll_at = (now + timedelta(minutes=interval_minutes)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE channels SET poll_interval_minutes = ?, next_poll_at = ?, last_polled_at = ?
+                WHERE channel_id = ?
+            """, (interval_minutes, next_poll_at, now.strftime("%Y-%m-%dT%H:%M:%SZ"), channel_id))
+
+    def known_video_ids(self, video_ids) -> set:
+        """Subset of `video_ids` already stored."""
+        video_ids = list(video_ids)
+        if not video_ids:
+            return set()
+        placeholders = ",".join("?" * len(video_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT video_id FROM videos WHERE video_id IN ({placeholders})", video_ids
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def get_sync_state(self, channel_id) -> dict | None:
+        """High-water mark of the last incremental sync for a channel, and where an unfinished one stopped."""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT uploads_playlist_id, last_video_id, last_published_at, last_synced_at, resume_page_token
+                FROM channel_sync WHERE channel_id = ?
+            """, (channel_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(
+            ("uploads_playlist_id", "last_video_id", "last_published_at", "last_synced_at", "resume_page_token"), row
+        ))
+
+    def save_sync_state(self, channel_id, uploads_playlist_id, last_video_id=None, last_published_at=None,
+                        resume_page_token=None):
+        """
+        Record a sync, moving the high-water mark forward when newer videos were seen.
+
+        `resume_page_token` is where a sync cut short by quota or SYNC_MAX_PAGES
+        stopped; it replaces the stored one, None meaning nothing is left to fetch.
+        """
+        now = utc_now()
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT INTO channel_sync
+                    (channel_id, uploads_playlist_id, last_video_id, last_published_at, last_synced_at, resume_page_token)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    uploads_playlist_id = excluded.uploads_playlist_id,
+                    last_video_id = COALESCE(excluded.last_video_id, channel_sync.last_video_id),
+                    last_published_at = COALESCE(excluded.last_published_at, channel_sync.last_published_at),
+                    last_synced_at = excluded.last_synced_at,
+                    resume_page_token = excluded.resume_page_token
+            """, (channel_id, uploads_playlist_id, last_video_id, last_published_at, now, resume_page_token))
+
+    def record_quota(self, endpoint, units=None):
+        """Add the quota cost of one API call to today's total."""
+        units = QUOTA_COSTS.get(endpoint, 1) if units is None else units
+        metrics.incr("youtube_quota_units", units, endpoint=endpoint)
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT INTO api_quota (day, endpoint, units) VALUES (?, ?, ?)
+                ON CONFLICT(day, endpoint) DO UPDATE SET units = units + excluded.units
+            """, (quota_day(), endpoint, units))
+
+    def quota_used_today(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(units), 0) FROM api_quota WHERE day = ?", (quota_day(),)
+            ).fetchone()[0]
+
+    def get_video(self, video_id) -> dict | None:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM videos WHERE video_id = ?", (video_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip((column[0] for column in cursor.description), row))
+
+    def get_videos_without_voice_notes(self):
+        with self._lock:
+            return self._conn.execute("""
+                SELECT video_id,title FROM videos WHERE voice_note_generated = 0
+            """).fetchall()
+
+    def set_voice_note_status(self, video_ids, status: int = 1):
+        """Set the voice note status for many videos in one transaction."""
+        with self.transaction() as conn:
+            conn.executemany("""
+                UPDATE videos SET voice_note_generated = ? WHERE video_id = ?
+            """, [(status, video_id) for video_id in video_ids])
+
+    def set_voice_note_path(self, video_id, path):
+        """Mark a video as voiced and remember where its mp3 is, so near-duplicates can link to it."""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE videos SET voice_note_generated = 1, voice_note_path = ? WHERE video_id = ?
+            """, (path, video_id))
+
+    def set_duplicate(self, video_id, original_id, similarity):
+        """Record that a video is a near-duplicate of `original_id` (None clears it)."""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE videos SET duplicate_of = ?, similarity = ? WHERE video_id = ?
+            """, (original_id, similarity, video_id))
+
+    def save_signature(self, video_id, shingle_count, signature: bytes, buckets):
+        """Store a transcript's MinHash signature and its (band, bucket) keys in one transaction."""
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO transcript_signatures (video_id, shingle_count, signature, indexed_at)
+                VALUES (?, ?, ?, ?)
+            """, (video_id, shingle_count, signature, utc_now()))
+            conn.executemany("""
+                INSERT OR IGNORE INTO lsh_buckets (band, bucket, video_id) VALUES (?, ?, ?)
+            """, [(band, bucket, video_id) for band, bucket in buckets])
+
+    def bucket_candidates(self, buckets, exclude=None) -> list:
+        """(video_id, signature) of every indexed video sharing at least one (band, bucket) key."""
+        if not buckets:
+            return []
+        with self._lock:
+            return self._conn.execute(f"""
+                WITH keys (band, bucket) AS (VALUES {", ".join("(?, ?)" for _ in buckets)})
+                SELECT s.video_id, s.signature FROM transcript_signatures s
+                WHERE s.video_id IN (
+                    SELECT b.video_id FROM keys k JOIN lsh_buckets b ON b.band = k.band AND b.bucket = k.bucket
+                ) AND s.video_id IS NOT ?
+            """, (*(value for key in buckets for value in key), exclude)).fetchall()
+
+    def clear_signatures(self):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM lsh_buckets")
+            conn.execute("DELETE FROM transcript_signatures")
+
+    def videos_without_signature(self) -> list:
+        """Voiced originals whose transcripts aren't in the dedup index yet."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("""
+                SELECT video_id FROM videos
+                WHERE voice_note_generated = 1 AND duplicate_of IS NULL
+                  AND video_id NOT IN (SELECT video_id FROM transcript_signatures)
+            """)]
+
+    def set_docs_status(self, video_ids, status: int = 1):
+        """Mark many videos as written to the Google Doc in one transaction."""
+        with self.transaction() as conn:
+            conn.executemany("""
+                UPDATE videos SET data_updated_in_docs = ? WHERE video_id = ?
+            """, [(status, video_id) for video_id in video_ids])
+            conn.executemany("DELETE FROM docs_appends WHERE video_id = ?", [(video_id,) for video_id in video_ids])
+
+    def get_docs_append(self, video_id) -> dict | None:
+        """Where a video's report was being appended and how many of its batches landed, if one was started."""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT document_id, start_index, batches_sent, requests_digest FROM docs_appends WHERE video_id = ?
+            """, (video_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("document_id", "start_index", "batches_sent", "requests_digest"), row))
+
+    def save_docs_append(self, video_id, document_id, start_index, batches_sent, requests_digest):
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO docs_appends (video_id, document_id, start_index, batches_sent, requests_digest)
+                VALUES (?, ?, ?, ?, ?)
+            """, (video_id, document_id, start_index, batches_sent, requests_digest))
+
+    def set_all_voice_notes_status(self, status: int = 1):
+        with self.transaction() as conn:
+            conn.execute("UPDATE videos SET voice_note_generated = ?", (status,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository() -> VideoRepository:
+    """Process-wide repository, opened on first use."""
+    global _repository
+    with _repository_lock:
+        if _repository is None:
+            _repository = VideoRepository(DB_PATH)
+        return _repository
+
 
 def create_db():
     """Create the SQLite database and videos table if it doesn't exist."""
-    # Use an absolute path to the DB file, relative to this script's directory
-    db_path = os.path.join(os.path.dirname(__file__), "youtube_video_data.db")
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS videos (
-            video_id TEXT PRIMARY KEY,
-            title TEXT,
-            published_at TEXT,
-            description TEXT,
-            url TEXT,
-            voice_note_generated INTEGER DEFAULT 0,
-            data_updated_in_docs INTEGER DEFAULT 0      
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
-
-def fetch_new_videos():
-    """Fetch videos uploaded in the last N hours from the specified channel."""
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
-    print("Fetching new videos from YouTube...")
-    # Compute the time threshold (LOOKBACK_HOURS ago from now, in UTC)
-    from datetime import datetime, timedelta, timezone
-    time_threshold = (datetime.now(timezone.utc) - timedelta(hours=LOOKBACK_HOURS)).strftime("%Y-%m-%dT%H:%M:%SZ")
-    # Search for videos published after the threshold
-    request = youtube.search().list(
-        part="snippet",
-        channelId=CHANNEL_ID,
-        publishedAfter=time_threshold,
-        type="video",
-        order="date",
-        maxResults=50
+    get_repository()
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def quota_day() -> str:
+    """Current YouTube quota day (resets at midnight Pacific time)."""
+    return datetime.now(QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+_thread_local = threading.local()
+
+def build_youtube_client():
+    import googleapiclient.discovery
+    return googleapiclient.discovery.build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
+
+def _thread_http():
+    """httplib2 isn't thread-safe, so each thread sharing the client gets its own transport."""
+    if not hasattr(_thread_local, "http"):
+        import httplib2
+        _thread_local.http = httplib2.Http()
+    return _thread_local.http
+
+def execute_youtube(request):
+    """Execute a Data API request under the YouTube rate limiter; quota errors (403) are not retried."""
+    return rate_limit.call_with_retry(
+        "youtube", lambda: request.execute(http=_thread_http()),
+        max_retries=YOUTUBE_MAX_RETRIES, base_seconds=YOUTUBE_RETRY_BASE_SECONDS,
     )
 
-    response = request.execute()
-    return response.get("items", [])
+def get_uploads_playlist_id(youtube, channel_id, repository):
+    """The playlist holding every upload of a channel (UC... channels map to UU...)."""
+    if channel_id.startswith("UC"):
+        return "UU" + channel_id[2:]
+    response = execute_youtube(youtube.channels().list(part="contentDetails", id=channel_id))
+    repository.record_quota("channels.list")
+    return response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+
+def fetch_new_videos(channel_id=CHANNEL_ID, youtube=None, repository=None):
+    """
+    Incrementally fetch a channel's new uploads, newest first.
+
+    Pages through the channel's uploads playlist (1 quota unit per 50 videos,
+    versus 100 per search call) and stops at the first video already stored
+    or older than the channel's high-water mark. Without a high-water mark
+    the sync is limited to LOOKBACK_HOURS unless SYNC_BACKFILL_ALL is set.
+
+    A sync cut short by YOUTUBE_DAILY_QUOTA or SYNC_MAX_PAGES returns the page
+    token it stopped at. The next sync first fetches uploads newer than what
+    is stored, then carries on from that token down to the high-water mark,
+    skipping videos it already has, so the older uploads aren't lost.
+
+    Returns:
+        tuple[str, list, str | None]: (uploads playlist id, rows of
+        (video_id, title, published_at, description, url, channel_id), newest first,
+        page token to resume from, or None once everything down to the mark is fetched).
+    """
+    youtube = youtube or build_youtube_client()
+    repository = repository or get_repository()
+    state = repository.get_sync_state(channel_id) or {}
+    playlist_id = state.get("uploads_playlist_id") or get_uploads_playlist_id(youtube, channel_id, repository)
+    if state.get("last_published_at"):
+        cutoff = state["last_published_at"]
+    elif SYNC_BACKFILL_ALL:
+        cutoff = ""
+    else:
+        # Compute the time threshold (LOOKBACK_HOURS ago from now, in UTC)
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=LOOKBACK_HOURS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    rows = []
+    pages = 0
+
+    def scan(page_token, stop_at_known):
+        """Page down the playlist from `page_token`. Returns (reached the mark or the end, token to resume from)."""
+        nonlocal pages
+        while True:
+            if repository.quota_used_today() + QUOTA_COSTS["playlistItems.list"] > YOUTUBE_DAILY_QUOTA:
+                print(f"⚠️ Daily YouTube quota ({YOUTUBE_DAILY_QUOTA} units) reached, resuming next sync.")
+                return False, page_token
+            if pages >= SYNC_MAX_PAGES:
+                print(f"⚠️ Stopped {channel_id} after {SYNC_MAX_PAGES} pages, resuming next sync.")
+                return False, page_token
+            response = execute_youtube(youtube.playlistItems().list(
+                part="snippet,contentDetails",
+                playlistId=playlist_id,
+                maxResults=50,
+                pageToken=page_token,
+            ))
+            repository.record_quota("playlistItems.list")
+            pages += 1
+
+            items = response.get("items", [])
+            known = repository.known_video_ids(item["contentDetails"]["videoId"] for item in items)
+            for item in items:
+                video_id = item["contentDetails"]["videoId"]
+                snippet = item["snippet"]
+                published_at = item["contentDetails"].get("videoPublishedAt") or snippet["publishedAt"]
+                if video_id == state.get("last_video_id") or published_at <= cutoff or (stop_at_known and video_id in known):
+                    return True, None
+                if video_id in known or snippet["title"] in ("Private video", "Deleted video"):
+                    continue
+                # Use the standard YouTube video URL format
+                url = f"https://www.youtube.com/watch?v={video_id}"
+                rows.append((video_id, snippet["title"], published_at, snippet["description"], url, channel_id))
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return True, None
+
+    # Newest uploads first; they stop at the newest stored video
+    finished, resume_page_token = scan(None, stop_at_known=True)
+    if not finished:
+        # Cut short before any page: the unfinished sync, if any, still stands. Otherwise this
+        # gap supersedes it, since carrying on from here walks down through the older gap too.
+        resume_page_token = resume_page_token or state.get("resume_page_token")
+    elif state.get("resume_page_token"):
+        # Uploads between the newest stored videos and the mark, left by a sync that was cut short
+        finished, resume_page_token = scan(state["resume_page_token"], stop_at_known=False)
+
+    rows.sort(key=lambda row: row[2], reverse=True)
+    print(f"📡 Synced {channel_id}: {len(rows)} new videos in {pages} pages "
+          f"({repository.quota_used_today()}/{YOUTUBE_DAILY_QUOTA} quota units used today)")
+    return playlist_id, rows, resume_page_token
 
-def store_new_videos(videos):
+def store_new_videos(rows):
     """Store only new (not previously stored) videos in the database."""
-    conn = sqlite3.connect("youtube_video_data.db")
-    cursor = conn.cursor()
-
-    new_count = 0
-    for item in videos:
-        video_id = item["id"]["videoId"]
-        title = item["snippet"]["title"]
-        published_at = item["snippet"]["publishedAt"]
-        description = item["snippet"]["description"]
-        
-        # CORRECTED LINE: Use the standard YouTube video URL format
-        url = f"https://www.youtube.com/watch?v={video_id}" 
-
-        try:
-            cursor.execute("""
-                INSERT INTO videos (video_id, title, published_at, description, url)
-                VALUES (?, ?, ?, ?, ?)
-            """, (video_id, title, published_at, description, url))
-            new_count += 1
-        except sqlite3.IntegrityError:
-            # Already stored video — skip it
-            continue
-
-    conn.commit()
-    conn.close()
-    return new_count
+    return get_repository().upsert_videos(rows)
+
 def get_videos_without_voice_notes():
-    """Fetch videos that have voice notes generated."""
-    conn = sqlite3.connect("youtube_video_data.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT video_id,title FROM videos WHERE voice_note_generated = 0
-    """)
-    videos = cursor.fetchall()
-
-    conn.close()
-    return videos
-
-def update_voice_note_status(video_id):
-    """Update the voice note generated status for a video."""
-    conn = sqlite3.connect("youtube_video_data.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        UPDATE videos SET voice_note_generated = 1 WHERE video_id = ?
-    """, (video_id,))
-
-    conn.commit()
-    conn.close()
-    
+    """Fetch videos that don't have voice notes generated yet."""
+    return get_repository().get_videos_without_voice_notes()
+
+def update_voice_note_status(video_id, voice_note_path=None):
+    """Update the voice note generated status for a video, with its mp3 path when known."""
+    if voice_note_path:
+        get_repository().set_voice_note_path(video_id, voice_note_path)
+    else:
+        get_repository().set_voice_note_status([video_id])
+
+def update_voice_notes_status(video_ids):
+    """Update the voice note generated status for many videos in one transaction."""
+    get_repository().set_voice_note_status(video_ids)
+
+def update_docs_status(video_id):
+    """Mark a video's report as appended to the Google Doc."""
+    get_repository().set_docs_status([video_id])
+
 def update_all_voice_notes_status():
     """Update all voice notes status to 1."""
-    conn = sqlite3.connect("youtube_video_data.db")
-    cursor = conn.cursor()
     print("Updating all voice notes status to 1..."         )
-    cursor.execute("""
-        UPDATE videos SET voice_note_generated = 1
-    """)
+    get_repository().set_all_voice_notes_status(1)
+
+
+def poll_interval_minutes(upload_times) -> int:
+    """Poll a channel about four times per typical gap between its uploads, within configured bounds."""
+    import statistics  # pulls in fractions and decimal; kept off the CLI's startup path
+
+    times = [datetime.strptime(t, "%Y-%m-%dT%H:%M:%SZ") for t in upload_times]
+    gaps = [(newer - older).total_seconds() / 60 for newer, older in zip(times, times[1:])]
+    if not gaps:
+        return CHANNEL_POLL_MIN_MINUTES
+    interval = int(statistics.median(gaps) / 4)
+    return max(CHANNEL_POLL_MIN_MINUTES, min(CHANNEL_POLL_MAX_MINUTES, interval))
 
-    conn.commit()
-    conn.close()
-    
+def sync_channel(channel_id, youtube=None, repository=None):
+    """Sync one channel and schedule its next poll. Returns (fetched, new) video counts."""
+    repository = repository or get_repository()
+    with metrics.timed("youtube.sync", channel_id=channel_id) as span:
+        playlist_id, videos, resume_page_token = fetch_new_videos(channel_id, youtube=youtube, repository=repository)
+        span["videos_fetched"] = len(videos)
+    with metrics.timed("db.upsert_videos") as span:
+        new_count = repository.upsert_videos(videos)
+        span["videos_new"] = new_count
+    # Only move the high-water mark once the videos are safely stored, and only once nothing
+    # older than them is left to fetch: later syncs stop at the mark
+    newest_id, newest_published_at = (None, None) if resume_page_token else repository.newest_video(channel_id)
+    repository.save_sync_state(channel_id, playlist_id, newest_id, newest_published_at, resume_page_token)
+    repository.schedule_next_poll(channel_id, poll_interval_minutes(repository.recent_upload_times(channel_id)))
+    return len(videos), new_count
+
+def subscribed_channel_ids():
+    """Channels from config: CHANNEL_IDS, or the single CHANNEL_ID."""
+    return list(CHANNEL_IDS) or [CHANNEL_ID]
+
+def sync_subscribed_channels(force=False, youtube=None):
+    """
+    Poll every subscribed channel that is due, concurrently, through one shared API client.
+
+    Args:
+        force (bool): Poll all channels regardless of their schedule.
+        youtube: Optional prebuilt YouTube client, reused across calls.
+
+    Returns:
+        tuple[int, int]: Total (fetched, new) video counts.
+    """
+    from concurrent.futures import ThreadPoolExecutor
 
-def fetch_new_youtube_videos():
+    repository = get_repository()
+    repository.subscribe_channels(subscribed_channel_ids())
+    due = [row[0] for row in repository.get_channels()] if force else repository.get_due_channels()
+    if not due:
+        print("⏳ No channels due for polling.")
+        return 0, 0
+
+    print(f"Fetching new videos from YouTube for {len(due)} channels...")
+    youtube = youtube or build_youtube_client()
+    fetched = new = 0
+    with ThreadPoolExecutor(max_workers=CHANNEL_SYNC_CONCURRENCY) as pool:
+        futures = {channel_id: pool.submit(sync_channel, channel_id, youtube, repository) for channel_id in due}
+        for channel_id, future in futures.items():
+            try:
+                channel_fetched, channel_new = future.result()
+            except Exception as e:
+                print(f"❌ Sync failed for {channel_id}: {e}")
+                continue
+            fetched += channel_fetched
+            new += channel_new
+    return fetched, new
+
+def fetch_new_youtube_videos(force=False):
     create_db()
     print("Fetching new videos...")
-    videos = fetch_new_videos()
-    # print(f"Fetched {len(videos)} videos from API.")
-    new_count = store_new_videos(videos)
-    # print(f"Stored {new_count} new videos in the database.")
+    fetched, new_count = sync_subscribed_channels(force=force)
     if new_count > 0:
         print(f"✅ {new_count} new videos stored in the database.")
     else:
         print("⚠️ No new videos found or all videos already stored.")
-    return len(videos), new_count
+    return fetched, new_count
 # Only runs if this file is executed directly
 if __name__ == "__main__":
     fetch_new_youtube_videos()
-
-
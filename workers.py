@@ -0,0 +1,182 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import metrics
+import rate_limit
+from config import (
+    GEMINI_API_KEY,
+    WORKER_HEARTBEAT_SECONDS,
+    WORKER_MAX_RESPAWNS,
+    WORKER_PROCESSES,
+    WORKER_STALE_SECONDS,
+)
+from docs_updater import set_append_guard
+from job_queue import JobQueue
+from pipeline import STAGE_HANDLERS, VIDEO_STAGES, enqueue_pending_videos, run_pipeline, run_stats
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def process_worker_id(pid: int = None) -> str:
+    """Id of a worker process; run_pipeline's lease owners extend it with ':<n>'."""
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+async def _drain(job_queue, stages, follow):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async def stop_when_drained():
+        # Other processes' jobs can unlock ours, so only stop once nothing is running anywhere
+        while not stop_event.is_set():
+            await asyncio.sleep(1)
+            if not await asyncio.to_thread(job_queue.has_work, stages):
+                stop_event.set()
+
+    watcher = None if follow else asyncio.create_task(stop_when_drained())
+    try:
+        await run_pipeline(job_queue, stop_event=stop_event, stages=stages)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+
+def run_worker(stages=None, follow=False, rate_share=1.0):
+    """
+    Run one worker process against the shared job queue.
+
+    The worker registers in the `workers` table and heartbeats there every
+    WORKER_HEARTBEAT_SECONDS with its run counters. It claims jobs for
+    `stages` until no job is claimable or running in any process, or with
+    `follow` until SIGINT/SIGTERM. `rate_share` scales every API rate limit
+    for this process, so N workers together stay within the configured limits.
+    Docs appends take a lock in the DB, so reports never interleave. Any host
+    that can open the DB file can run workers.
+    """
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    rate_limit.set_share(rate_share)
+    stages = list(stages or STAGE_HANDLERS)
+    job_queue = JobQueue()
+    worker_id = process_worker_id()
+    job_queue.register_worker(worker_id, socket.gethostname(), os.getpid(), stages)
+    # Reports from different workers must not interleave in the document
+    set_append_guard(lambda document_id: job_queue.locked(f"docs:{document_id}", worker_id))
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(WORKER_HEARTBEAT_SECONDS):
+            job_queue.heartbeat(worker_id, run_stats)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    print(f"👷 Worker {worker_id} started for {', '.join(stages)}")
+    state = "crashed"
+    try:
+        asyncio.run(_drain(job_queue, stages, follow))
+        state = "exited"
+    finally:
+        stopped.set()
+        job_queue.heartbeat(worker_id, run_stats, state=state)
+    print(f"👷 Worker {worker_id} finished: {run_stats['converted_videos']} voice notes, "
+          f"{run_stats['deduplicated_videos']} linked duplicates, {run_stats['docs_reports']} docs reports, {run_stats['failed_conversions']} failed")
+
+
+def run_coordinator(processes=None, sync=True, force=False, worker_command=None) -> dict:
+    """
+    Process the backlog with `processes` worker processes on this host.
+
+    Syncs channels and queues pending videos, then starts the workers and
+    watches them: a worker that exits with an error has its running jobs
+    handed straight back to the queue (rather than after JOB_LEASE_SECONDS)
+    and is respawned, up to WORKER_MAX_RESPAWNS times per slot. Any worker
+    sharing the DB, local or remote, that stops heartbeating for
+    WORKER_STALE_SECONDS is treated the same way. Returns the summed run
+    counters of all workers.
+
+    Args:
+        processes (int): Worker processes to run, defaults to WORKER_PROCESSES (0: one per CPU core).
+        sync (bool): Sync subscribed channels before starting.
+        force (bool): Poll all channels regardless of schedule.
+        worker_command (list): argv that starts one worker, `--stages` and `--rate-share` are appended.
+    """
+    from videos_controller import fetch_new_youtube_videos
+
+    processes = processes or WORKER_PROCESSES or os.cpu_count() or 1
+    start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    started_at = time.perf_counter()
+    if sync:
+        fetch_new_youtube_videos(force=force)
+    job_queue = JobQueue()
+    enqueue_pending_videos(job_queue)
+    stats = {key: 0 for key in run_stats}
+    if not job_queue.has_work():
+        print("✅ Nothing to do: no pending jobs.")
+        return stats
+
+    worker_command = worker_command or [sys.executable, MAIN_SCRIPT, "worker"]
+    slots = [{"stages": list(VIDEO_STAGES), "process": None, "respawns": 0} for _ in range(processes)]
+    worker_ids = []
+
+    def spawn(slot):
+        slot["process"] = subprocess.Popen(
+            worker_command + ["--stages", ",".join(slot["stages"]), "--rate-share", f"{1 / processes:.6g}"]
+        )
+        worker_ids.append(process_worker_id(slot["process"].pid))
+
+    print(f"🏭 Starting {processes} workers")
+    for slot in slots:
+        spawn(slot)
+
+    next_stale_check = time.monotonic() + WORKER_HEARTBEAT_SECONDS
+    try:
+        while any(slot["process"] for slot in slots):
+            time.sleep(1)
+            for slot in slots:
+                process = slot["process"]
+                if process is None or process.poll() is None:
+                    continue
+                slot["process"] = None
+                worker_id = process_worker_id(process.pid)
+                reclaimed = job_queue.reclaim_jobs(worker_id)
+                if process.returncode == 0:
+                    continue
+                metrics.incr("worker_crashes")
+                print(f"💥 Worker {worker_id} exited with code {process.returncode}, {reclaimed} jobs handed back")
+                if slot["respawns"] < WORKER_MAX_RESPAWNS and job_queue.has_work(slot["stages"]):
+                    slot["respawns"] += 1
+                    spawn(slot)
+
+            if time.monotonic() >= next_stale_check:
+                next_stale_check = time.monotonic() + WORKER_HEARTBEAT_SECONDS
+                for worker_id, reclaimed in job_queue.reclaim_stale_workers(WORKER_STALE_SECONDS).items():
+                    print(f"🪦 Worker {worker_id} stopped heartbeating, {reclaimed} jobs handed back")
+                    for slot in slots:
+                        # A hung local worker is killed, then respawned like a crashed one
+                        if slot["process"] and process_worker_id(slot["process"].pid) == worker_id:
+                            slot["process"].kill()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the workers too; they finish their current job and exit
+        print("\n🛑 Waiting for workers to finish their current jobs...")
+        for slot in slots:
+            if slot["process"]:
+                slot["process"].wait()
+
+    workers = {worker["worker_id"]: worker for worker in job_queue.workers()}
+    for worker_id in worker_ids:
+        for key, value in workers.get(worker_id, {}).get("stats", {}).items():
+            stats[key] = stats.get(key, 0) + value
+    job_queue.remove_workers(worker_ids)
+    seconds = round(time.perf_counter() - started_at, 2)
+    metrics.record("run", mode="workers", processes=processes, start_time=start_time, seconds=seconds, ok=True, **stats)
+    print(f"✅ {processes} workers done in {seconds:.0f}s: {stats['converted_videos']} voice notes, "
+          f"{stats['deduplicated_videos']} linked duplicates, {stats['docs_reports']} docs reports, {stats['failed_conversions']} failed")
+    return stats